@@ -2,12 +2,32 @@ import openai
 from flask import Flask, request, jsonify
 import os
 
+from chat_cache import ChatCache
+from chat_context import ChatContext
+from chat_prompt import MAX_TOKENS, MODEL, TEMPERATURE, build_messages
+from chat_router import ChatRouter
+import instrumentation
+
 # Ensure the API key is loaded from the environment variable
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # Initialize Flask app
 app = Flask(__name__)
 
+# Numeric questions are answered from the dataset; the others get a summary of it in the
+# prompt, and answers to repeated questions about the same dashboard view are cached
+router = ChatRouter()
+context = ChatContext()
+chat_cache = ChatCache()
+
+# Request latency and size, upstream LLM time and cache hit rates at /metrics
+instrumentation.instrument_flask(app)
+instrumentation.register_cache("chat_answers", chat_cache.stats)
+upstream_seconds = instrumentation.REGISTRY.summary("llm_upstream_seconds", "Time spent waiting for the LLM")
+instrumentation.REGISTRY.gauge("chat_local_answer_share", "Share of questions answered from the dataset").set_function(
+    lambda: router.stats()["local_share"]
+)
+
 # Root route for testing the server
 @app.route("/", methods=["GET"])
 def home():
@@ -25,32 +45,43 @@ def chat():
         if not user_query:
             return jsonify({"error": "Missing 'query' field in the request."}), 400
 
-        # Prepare dynamic context
-        context = (
-            f"You are assisting with a land cover monitoring dashboard. "
-            f"The user is analyzing land cover data for {dashboard_data.get('land_cover', 'unknown land cover')} "
-            f"from {dashboard_data.get('start_year', 'unknown year')} to {dashboard_data.get('end_year', 'unknown year')}.\n\n"
-            f"User Query: {user_query}"
-        )
+        local = router.answer(user_query, dashboard_data)
+        if local is not None:
+            return jsonify({"response": local}), 200, {"X-Route": "local"}
+
+        cached = chat_cache.lookup(user_query, dashboard_data)
+        if cached is not None:
+            return jsonify({"response": cached}), 200, {"X-Route": "llm", "X-Cache": "hit"}
 
         # Generate response using OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an AI assistant for land monitoring."},
-                {"role": "user", "content": context},
-            ],
-            max_tokens=200,
-            temperature=0.7,
-        )
+        messages = build_messages(user_query, dashboard_data, context.build(dashboard_data))
+        with upstream_seconds.time():
+            response = openai.ChatCompletion.create(
+                model=MODEL,
+                messages=messages,
+                max_tokens=MAX_TOKENS,
+                temperature=TEMPERATURE,
+            )
 
         ai_response = response['choices'][0]['message']['content']
-        return jsonify({"response": ai_response})
+        chat_cache.store(user_query, dashboard_data, ai_response)
+        return jsonify({"response": ai_response}), 200, {"X-Route": "llm", "X-Cache": "miss"}
 
     except Exception as e:
         return jsonify({"error": f"Server Error: {str(e)}"}), 500
 
 
+# Size and hit rate of the chat answer cache
+@app.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    return jsonify(chat_cache.stats())
+
+
+# Share of chat questions answered from the dataset without the LLM
+@app.route("/router-stats", methods=["GET"])
+def router_stats():
+    return jsonify(router.stats())
+
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
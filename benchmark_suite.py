@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Benchmarks for the dashboard callbacks and the chat API. Every run is appended to a
+# JSON-lines history, and each result is compared with the median of the previous runs of
+# the same case: a metric that got worse by more than its threshold is a regression.
+HISTORY_FILE = "benchmark_history.jsonl"
+SCALES = [1, 100, 10000]  # dataset sizes, as multiples of combined_land_cover_data.csv (17 classes x 34 years)
+BASE_CLASSES = 17
+BASE_YEARS = 34
+FIRST_YEAR = 2001
+SEED = 42
+
+# Allowed relative change before a metric counts as a regression (higher is worse,
+# except for throughput), the absolute change below which it is noise, and how many
+# previous runs form the baseline
+THRESHOLDS = {"p50_ms": 0.25, "p95_ms": 0.35, "bytes": 0.10, "peak_kb": 0.25, "rss_mb": 0.25, "ttft_p95_ms": 0.35, "throughput": 0.20}
+NOISE_FLOOR = {"p50_ms": 1.0, "p95_ms": 2.0, "bytes": 256, "peak_kb": 64, "rss_mb": 32, "ttft_p95_ms": 5.0, "throughput": 0.0}
+HIGHER_IS_BETTER = {"throughput"}
+BASELINE_RUNS = 5
+
+
+def make_dataset(scale, seed=SEED):
+    # Random-walk yearly values; classes and years each grow with the square root of the scale
+    factor = max(1, int(round(scale ** 0.5)))
+    classes, years = BASE_CLASSES * factor, BASE_YEARS * factor
+    rng = np.random.default_rng(seed)
+    values = np.cumsum(rng.normal(0, 1000, size=(classes, years)), axis=1).astype(np.float32)
+    values[:, 0] = 0
+    names = [f"Synthetic Class {i}" for i in range(classes)]
+    return pd.DataFrame({
+        "Year": np.tile(np.arange(FIRST_YEAR, FIRST_YEAR + years, dtype=np.int16), classes),
+        "Land_Cover_Type": pd.Categorical(np.repeat(names, years), categories=names),
+        "Value": values.ravel(),
+    })
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+def timing_stats(samples_ms):
+    return {
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+        "mean_ms": statistics.fmean(samples_ms),
+    }
+
+
+def dashboard_cases(df):
+    # Representative (graph, year range, theme, update mode) inputs
+    first, last = int(df["Year"].min()), int(df["Year"].max())
+    ranges = {"full": [first, last], "half": [first, (first + last) // 2], "recent": [max(first, last - 9), last]}
+    for kind in ("trend-line", "bar-chart", "scatter-plot", "metrics"):
+        for range_name, year_range in ranges.items():
+            for theme in ((True, False) if kind != "metrics" else (True,)):
+                for mode in (("full", "patch") if kind != "metrics" else ("full",)):
+                    yield kind, range_name, year_range, theme, mode
+
+
+def dashboard_request(kind, land_cover, year_range, theme, mode):
+    inputs = [
+        {"id": "land-cover-dropdown", "property": "value", "value": land_cover},
+        {"id": "year-range-slider", "property": "value", "value": year_range},
+    ]
+    if kind == "metrics":
+        outputs = [{"id": name, "property": "children"} for name in ("total-area", "max-change", "avg-change")]
+        output = "..total-area.children...max-change.children...avg-change.children.."
+        state = []
+    else:
+        outputs = {"id": kind, "property": "figure"}
+        output = f"{kind}.figure"
+        state = [{"id": "theme-toggle", "property": "value", "value": theme}]
+    # A triggered input makes the figure callbacks send a partial update; the initial call sends the whole figure
+    changed = ["year-range-slider.value"] if mode == "patch" else []
+    return {"output": output, "outputs": outputs, "inputs": inputs, "state": state, "changedPropIds": changed}
+
+
+def bench_dashboard(scales, repeat):
+    # Callback latency (cold and warm caches), response size and peak memory per case,
+    # through the Dash HTTP endpoint
+    workdir = tempfile.mkdtemp(prefix="benchmark_")
+    os.environ.setdefault("DASHBOARD_CACHE_PATH", os.path.join(workdir, "dashboard_cache.sqlite"))
+    os.environ.setdefault("CHAT_JOBS_PATH", os.path.join(workdir, "chat_jobs.sqlite"))
+    os.environ.setdefault("CHAT_SESSIONS_PATH", os.path.join(workdir, "chat_sessions.sqlite"))
+    import data_access
+    import dashboard
+
+    client = dashboard.app.server.test_client()
+    results = []
+    for scale in scales:
+        start = time.perf_counter()
+        df = make_dataset(scale)
+        version = f"benchmark-{scale}-{SEED}"
+        # Serve the synthetic dataset as the current snapshot
+        data_access.combined_version = lambda version=version: version
+        data_access.load_combined = lambda df=df, **kwargs: df
+        dashboard.current_dataset_version()
+        load_ms = (time.perf_counter() - start) * 1000
+        land_cover = str(df["Land_Cover_Type"].cat.categories[0])
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # peak resident size so far, KB on Linux
+        print(f"Scale {scale}x: {len(df):,} rows, dataset ready in {load_ms:,.0f} ms, peak RSS {rss_mb:,.0f} MB")
+        results.append({"suite": "dashboard", "case": "load", "scale": scale, "rows": len(df), "p50_ms": load_ms, "rss_mb": rss_mb})
+
+        for kind, range_name, year_range, theme, mode in dashboard_cases(df):
+            body = json.dumps(dashboard_request(kind, land_cover, year_range, theme, mode))
+
+            def call():
+                response = client.post("/_dash-update-component", data=body, content_type="application/json")
+                if response.status_code != 200:
+                    raise RuntimeError(f"{kind} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+                return len(response.get_data())
+
+            def clear_caches():
+                dashboard.build_trace.cache_clear()
+                dashboard.build_metrics.cache_clear()
+                dashboard.result_cache.drop_other_versions("")
+
+            cold, warm = [], []
+            for _ in range(repeat):
+                clear_caches()
+                t = time.perf_counter()
+                size = call()
+                cold.append((time.perf_counter() - t) * 1000)
+                t = time.perf_counter()
+                call()
+                warm.append((time.perf_counter() - t) * 1000)
+
+            clear_caches()
+            tracemalloc.start()
+            call()
+            peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+
+            case = f"{kind}/{range_name}/{'dark' if theme else 'light'}/{mode}"
+            for cache, samples in (("cold", cold), ("warm", warm)):
+                results.append({
+                    "suite": "dashboard",
+                    "case": f"{case}/{cache}",
+                    "scale": scale,
+                    **timing_stats(samples),
+                    "bytes": size,
+                    "peak_kb": peak_kb if cache == "cold" else None,
+                })
+            print(f"  {case:40s} cold p50 {percentile(cold, 50):8.2f} ms  warm p50 {percentile(warm, 50):6.2f} ms  "
+                  f"{size:>9,} bytes  peak {peak_kb:,.0f} KB")
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    import requests
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def chat_load(url, concurrency, total, stream):
+    # total requests from concurrency clients; every question is open-ended and unique, so
+    # neither the local router nor the answer cache answers it
+    import aiohttp
+
+    latencies, first_tokens, rejected, errors = [], [], 0, 0
+    counter = iter(range(total))
+
+    async def client(session):
+        nonlocal rejected, errors
+        for _ in counter:
+            payload = {"query": f"Explain the landscape in scenario {uuid.uuid4().hex}", "dashboard_data": {}, "stream": stream}
+            start = time.perf_counter()
+            first = None
+            try:
+                async with session.post(url, json=payload) as response:
+                    if response.status == 429:
+                        rejected += 1
+                        continue
+                    if response.status != 200:
+                        errors += 1
+                        continue
+                    async for line in response.content:
+                        if first is None and line.startswith(b"data:"):
+                            first = time.perf_counter() - start
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            first_tokens.append((first if first is not None else time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300)) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return latencies, first_tokens, rejected, errors, elapsed
+
+
+def bench_chat(concurrency_levels, total, ttft, tokens_per_second, tokens, url=None, stream=True):
+    # Start the mock LLM and the async chat server (unless url points at a running server)
+    # and drive concurrent load against /chat
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="benchmark_chat_")
+    try:
+        if url is None:
+            llm_port, chat_port = free_port(), free_port()
+            env = {**os.environ, "CHAT_CACHE_PATH": os.path.join(workdir, "chat_cache.sqlite")}
+            processes.append(subprocess.Popen(
+                [sys.executable, "mock_llm.py", "--port", str(llm_port), "--ttft", str(ttft),
+                 "--tokens-per-second", str(tokens_per_second), "--tokens", str(tokens)],
+                env=env, stdout=subprocess.DEVNULL,
+            ))
+            processes.append(subprocess.Popen(
+                [sys.executable, "chat_server.py", "--port", str(chat_port),
+                 "--llm-url", f"http://127.0.0.1:{llm_port}/v1/chat/completions"],
+                env=env, stdout=subprocess.DEVNULL,
+            ))
+            url = f"http://127.0.0.1:{chat_port}/chat"
+            wait_for(f"http://127.0.0.1:{chat_port}/")
+
+        results = []
+        for concurrency in concurrency_levels:
+            latencies, first_tokens, rejected, errors, elapsed = asyncio.run(chat_load(url, concurrency, total, stream))
+            result = {
+                "suite": "chat",
+                "case": f"{'stream' if stream else 'json'}/ttft{ttft}/tps{tokens_per_second}",
+                "concurrency": concurrency,
+                **timing_stats(latencies),
+                "p99_ms": percentile(latencies, 99),
+                "ttft_p50_ms": percentile(first_tokens, 50),
+                "ttft_p95_ms": percentile(first_tokens, 95),
+                "throughput": len(latencies) / elapsed,
+                "rejected": rejected,
+                "errors": errors,
+            }
+            results.append(result)
+            print(f"Concurrency {concurrency:4d}: {result['throughput']:7.1f} req/s, p50 {result['p50_ms']:8.1f} ms, "
+                  f"p95 {result['p95_ms']:8.1f} ms, first token p95 {result['ttft_p95_ms']:8.1f} ms, "
+                  f"{rejected} rejected, {errors} errors")
+        return results
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def result_key(result):
+    return (result["suite"], result["case"], result.get("scale"), result.get("concurrency"))
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_regressions(results, history):
+    # Compare each metric with the median of the same case in the last BASELINE_RUNS runs
+    previous = {}
+    for run in history[-BASELINE_RUNS:]:
+        for result in run["results"]:
+            previous.setdefault(result_key(result), []).append(result)
+
+    regressions = []
+    for result in results:
+        baseline_results = previous.get(result_key(result))
+        if not baseline_results:
+            continue
+        for metric, threshold in THRESHOLDS.items():
+            values = [r[metric] for r in baseline_results if r.get(metric) is not None]
+            if result.get(metric) is None or not values:
+                continue
+            baseline = statistics.median(values)
+            if baseline <= 0:
+                continue
+            delta = result[metric] - baseline
+            if metric in HIGHER_IS_BETTER:
+                delta = -delta
+            change = delta / baseline
+            if change > threshold and delta > NOISE_FLOOR[metric]:
+                regressions.append({
+                    "key": result_key(result), "metric": metric, "baseline": baseline,
+                    "value": result[metric], "change": change, "threshold": threshold,
+                })
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard callbacks and the chat API.")
+    parser.add_argument("suite", choices=["dashboard", "chat", "all"])
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="Dataset sizes (multiples of the real data)")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per dashboard case")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128], help="Concurrent chat clients")
+    parser.add_argument("--requests", type=int, default=200, help="Chat requests per concurrency level")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Mock LLM seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Mock LLM token rate")
+    parser.add_argument("--tokens", type=int, default=50, help="Mock LLM tokens per answer")
+    parser.add_argument("--no-stream", action="store_true", help="Ask /chat for JSON instead of server-sent events")
+    parser.add_argument("--chat-url", help="Benchmark a running /chat server instead of starting one")
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--label", default="", help="Free-form note stored with the run")
+    parser.add_argument("--no-record", action="store_true", help="Do not append this run to the history")
+    args = parser.parse_args()
+
+    results = []
+    if args.suite in ("dashboard", "all"):
+        results += bench_dashboard(args.scales, args.repeat)
+    if args.suite in ("chat", "all"):
+        results += bench_chat(args.concurrency, args.requests, args.ttft, args.tokens_per_second, args.tokens,
+                              args.chat_url, not args.no_stream)
+
+    regressions = find_regressions(results, load_history(args.history))
+    run = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "label": args.label,
+        "suite": args.suite,
+        "seed": SEED,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+        "regressions": regressions,
+    }
+    if not args.no_record:
+        with open(args.history, "a") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"Run appended to '{args.history}'.")
+
+    for regression in regressions:
+        print(f"REGRESSION {'/'.join(str(k) for k in regression['key'] if k is not None)} {regression['metric']}: "
+              f"{regression['baseline']:.2f} -> {regression['value']:.2f} ({regression['change']:+.0%}, "
+              f"threshold {regression['threshold']:.0%})")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the previous runs.")
+
+
+if __name__ == "__main__":
+    main()
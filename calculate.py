@@ -1,53 +1,127 @@
-import pandas as pd
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
-from sklearn.metrics import mean_squared_error
-
-# Load the actual data
-actual_data = pd.read_csv('processed_land_cover_data.csv')
-
-# Load the forecasted data (all_forecasted_land_cover.csv)
-forecast_data = pd.read_csv('all_forecasted_land_cover.csv')
-
-# Make sure the 'Year' column in both dataframes is of type int
-actual_data["Year"] = actual_data["Year"].astype(int)
-
-# Filter forecast data to match the actual years (2001-2023)
-forecast_data['Year'] = pd.to_datetime(forecast_data['ds']).dt.year
-forecast_data = forecast_data[forecast_data['Year'].between(2001, 2023)]
-
-# Debugging: Check if the year range and Land_Cover_Type are matching
-print("Actual Data Years: ", actual_data['Year'].unique())
-print("Forecast Data Years: ", forecast_data['Year'].unique())
-
-# Prepare a list to hold the RMSE results for each land cover type
-rmse_results = []
-
-# Calculate RMSE for each land cover type
-for column in actual_data.columns[1:]:
-    print(f"Processing Land Cover Type: {column}")
-    
-    # Merge actual and forecasted data by Year and Land_Cover_Type
-    merged_data = pd.merge(actual_data[['Year', column]], forecast_data[['Year', 'Land_Cover_Type', 'yhat']], 
-                           on='Year', how='inner')
-    
-    print(f"Merged Data for {column}:")
-    print(merged_data.head())  # Display the first few rows of merged data
-    
-    # Filter data by land cover type
-    merged_data = merged_data[merged_data['Land_Cover_Type'] == column]
-    
-    if not merged_data.empty:
-        # Calculate RMSE
-        rmse = np.sqrt(mean_squared_error(merged_data[column], merged_data['yhat']))
-        rmse_results.append({'Land_Cover_Type': column, 'RMSE': rmse})
+import pandas as pd
+
+import data_access
+import fast_forecast
+from forecasting import CACHE_DIR, _fit_prophet, build_series, series_hash
+
+FORECASTERS = ["prophet"] + fast_forecast.FAST_MODELS
+
+
+def align(actual_df, forecast_df):
+    # One keyed join of every class at once: (Year, Land_Cover_Type) -> actual vs forecast
+    actual_df = actual_df.rename(columns={"Value": "Actual"})
+    actual_df["Land_Cover_Type"] = actual_df["Land_Cover_Type"].astype(str)
+    forecast_df = forecast_df.copy()
+    forecast_df["Land_Cover_Type"] = forecast_df["Land_Cover_Type"].astype(str)
+    return actual_df.merge(forecast_df, on=["Year", "Land_Cover_Type"], how="inner")
+
+
+def score(aligned_df, group_columns=("Land_Cover_Type",)):
+    # RMSE, MAE, MAPE and interval coverage for every group, vectorized
+    error = aligned_df["yhat"] - aligned_df["Actual"]
+    nonzero = aligned_df["Actual"] != 0
+    metrics = pd.DataFrame({
+        **{column: aligned_df[column] for column in group_columns},
+        "squared_error": error ** 2,
+        "absolute_error": error.abs(),
+        "percentage_error": (error.abs() / aligned_df["Actual"].abs()).where(nonzero),
+        "covered": (
+            (aligned_df["Actual"] >= aligned_df["yhat_lower"]) & (aligned_df["Actual"] <= aligned_df["yhat_upper"])
+        ).astype(float),
+    })
+    grouped = metrics.groupby(list(group_columns), observed=True).agg(
+        RMSE=("squared_error", "mean"),
+        MAE=("absolute_error", "mean"),
+        MAPE=("percentage_error", "mean"),
+        Coverage=("covered", "mean"),
+        N=("squared_error", "size"),
+    )
+    grouped["RMSE"] = np.sqrt(grouped["RMSE"])
+    return grouped.reset_index()
+
+
+def _truncate(series, cutoff):
+    return {name: df.iloc[:cutoff] for name, df in series.items()}
+
+
+def backtest(series, models, initial=10, horizon=1, workers=None, cache_dir=CACHE_DIR):
+    # Rolling-origin backtest of each forecaster: fit on the first `cutoff` years, forecast
+    # the next `horizon` years, for every cutoff. Fast models run all series per cutoff
+    # as one array operation; Prophet fits run in a process pool (and reuse its cache).
+    n_points = min(len(df) for df in series.values())
+    cutoffs = list(range(initial, n_points - horizon + 1))
+    frames = []
+
+    for model in models:
+        if model == "prophet":
+            continue
+        for cutoff in cutoffs:
+            forecast = fast_forecast.forecast_frame(_truncate(series, cutoff), horizon, model)
+            forecast["Model"] = model
+            forecast["Cutoff"] = cutoff
+            frames.append(forecast)
+
+    if "prophet" in models:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for cutoff in cutoffs:
+                for name, df in _truncate(series, cutoff).items():
+                    key = series_hash(df, {}, horizon)
+                    cache_path = os.path.join(cache_dir, f"{key}.csv")
+                    if os.path.exists(cache_path):
+                        forecast = pd.read_csv(cache_path, parse_dates=["ds"])
+                        forecast["Land_Cover_Type"] = name
+                        forecast["Model"] = "prophet"
+                        forecast["Cutoff"] = cutoff
+                        frames.append(forecast)
+                        continue
+                    future = executor.submit(_fit_prophet, name, df, {}, horizon, cache_dir, key)
+                    futures[future] = cutoff
+            for future in as_completed(futures):
+                forecast = future.result()
+                forecast["Model"] = "prophet"
+                forecast["Cutoff"] = futures[future]
+                frames.append(forecast)
+
+    forecasts = pd.concat(frames, ignore_index=True)
+    forecasts["Year"] = pd.to_datetime(forecasts["ds"]).dt.year
+    return forecasts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score land cover forecasts against the historical data.")
+    parser.add_argument("--backtest", nargs="*", choices=FORECASTERS,
+                        help="Run a rolling-origin backtest of these forecasters instead of scoring "
+                             "all_forecasted_land_cover.csv")
+    parser.add_argument("--initial", type=int, default=10, help="Training years before the first cutoff")
+    parser.add_argument("--horizon", type=int, default=1, help="Years forecast after each cutoff")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--output", default="rmse_results.csv")
+    args = parser.parse_args()
+
+    # Load the actual data (Year, Land_Cover_Type, Value)
+    actual_data = data_access.load_history()
+
+    if args.backtest:
+        forecasts = backtest(build_series(actual_data), args.backtest, args.initial, args.horizon, args.workers)
+        results_df = score(align(actual_data, forecasts), ("Model", "Land_Cover_Type"))
     else:
-        print(f"No matching data found for {column}. Skipping...")
-        
-# Convert RMSE results into a DataFrame
-rmse_df = pd.DataFrame(rmse_results)
+        # Score the saved forecasts on the years they share with the actual data
+        forecast_data = data_access.load_forecast(columns=["Year", "Land_Cover_Type", "yhat", "yhat_lower", "yhat_upper"])
+        aligned = align(actual_data, forecast_data)
+        if aligned.empty:
+            print("No overlapping years between the forecasts and the actual data.")
+        results_df = score(aligned)
+
+    # Save the results to a CSV
+    results_df.to_csv(args.output, index=False)
+    print(results_df.to_string(index=False))
 
-# Save the RMSE results to a CSV
-rmse_df.to_csv('rmse_results.csv', index=False)
 
-# Display the RMSE results
-print(rmse_df)
+if __name__ == "__main__":
+    main()
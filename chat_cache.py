@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import data_access
+from chat_prompt import MAX_TOKENS, MODEL, SYSTEM_PROMPT, TEMPERATURE
+from shared_cache import SharedCache
+
+# Chat answers cached on disk for every server process on the host. Keys combine the
+# normalized question, the dashboard context and the model settings; entries expire after
+# TTL seconds, are evicted least-recently-used beyond MAX_BYTES, and are dropped when a
+# new snapshot of the dashboard dataset is published.
+CACHE_PATH = os.environ.get("CHAT_CACHE_PATH", ".chat_cache.sqlite")
+MAX_BYTES = 64 * 1024 * 1024
+TTL = 24 * 3600  # seconds
+
+
+def normalize_query(query):
+    # Case, Unicode forms, whitespace and trailing punctuation do not change the question
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?!. ")
+
+
+def cache_key(query, dashboard_data, model=MODEL, max_tokens=MAX_TOKENS, temperature=TEMPERATURE):
+    key = {
+        "query": normalize_query(query),
+        "dashboard_data": {name: dashboard_data.get(name) for name in sorted(dashboard_data)},
+        "model": model,
+        "system": SYSTEM_PROMPT,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def dataset_version():
+    try:
+        return data_access.combined_version()
+    except OSError:
+        return "none"
+
+
+class ChatCache(SharedCache):
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, ttl=TTL):
+        super().__init__(path, max_bytes)
+        self.ttl = ttl
+        self.version = None
+        self._version_lock = threading.Lock()
+
+    def current_version(self):
+        # Answers cached for other snapshots of the dataset are dropped when it changes
+        version = dataset_version()
+        if version != self.version:
+            with self._version_lock:
+                if version != self.version:
+                    self.drop_other_versions(version)
+                    self.version = version
+        return version
+
+    def lookup(self, query, dashboard_data):
+        # The cached answer, or None
+        key = cache_key(query, dashboard_data)
+        found, value = self.get(key, self.current_version())
+        if not found:
+            return None
+        created, response = value
+        if time.time() - created > self.ttl:
+            self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return response
+
+    def store(self, query, dashboard_data, response):
+        self.set(cache_key(query, dashboard_data), self.current_version(), (time.time(), response))
+
+    def stats(self):
+        stats = super().stats()
+        lookups = stats["hits"] + stats["misses"]
+        return {**stats, "hit_rate": stats["hits"] / lookups if lookups else 0.0, "ttl": self.ttl, "dataset_version": self.version}
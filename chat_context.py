@@ -0,0 +1,134 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+import data_access
+from query_layer import QueryLayer
+
+# Dataset facts for the LLM prompt. Per-class summaries are computed once per dataset
+# version; a year range is then summarized from prefix sums, so packing the context for
+# a request is a few dictionary lookups instead of a dataframe scan.
+CONTEXT_TOKENS = 400  # budget for the data section of the prompt
+CHARS_PER_TOKEN = 4  # estimate for English text and numbers with the GPT tokenizers
+HEADER = "Dataset facts (Value per land cover class and year):"
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def fmt(value, signed=False):
+    return f"{value:+,.0f}" if signed else f"{value:,.0f}"
+
+
+class ClassStats:
+    # One class: the query layer series plus prefix sums for least-squares slopes over any range
+
+    def __init__(self, name, series, intervals):
+        self.name = name
+        self.series = series
+        x = series.years.astype(np.float64)
+        self.prefix_x = np.concatenate([[0.0], np.cumsum(x)])
+        self.prefix_xx = np.concatenate([[0.0], np.cumsum(x * x)])
+        self.prefix_xy = np.concatenate([[0.0], np.cumsum(x * series.values)])
+        self.intervals = intervals  # year -> (lower, upper)
+
+    def slope(self, start, stop):
+        # Least-squares trend per year of values[start:stop]
+        n = stop - start
+        if n < 2:
+            return float("nan")
+        sx = self.prefix_x[stop] - self.prefix_x[start]
+        sy = self.series.prefix[stop] - self.series.prefix[start]
+        sxx = self.prefix_xx[stop] - self.prefix_xx[start]
+        sxy = self.prefix_xy[stop] - self.prefix_xy[start]
+        return float((n * sxy - sx * sy) / (n * sxx - sx * sx))
+
+    def summary(self, start_year, end_year, history_end):
+        # One line: change, trend, total, extremes and the forecast interval at the range end
+        series = self.series
+        start, stop = series.bounds(start_year, end_year)
+        if stop - start == 0:
+            return None
+        years, values = series.years[start:stop], series.values[start:stop]
+        total, _, _ = series.metrics(start, stop)
+        peak, low = int(np.argmax(values)), int(np.argmin(values))
+        line = (
+            f"{self.name} {years[0]}-{years[-1]}: {fmt(values[0])} -> {fmt(values[-1])} "
+            f"(change {fmt(values[-1] - values[0], True)}, trend {fmt(self.slope(start, stop), True)}/yr, "
+            f"total {fmt(total)}, max {fmt(values[peak])} in {years[peak]}, min {fmt(values[low])} in {years[low]})"
+        )
+        last = int(years[-1])
+        if last > history_end and last in self.intervals:
+            lower, upper = self.intervals[last]
+            line += f"; {last} is a forecast, prediction interval {fmt(lower)} to {fmt(upper)}"
+        return line + "."
+
+
+class ChatContext:
+
+    def __init__(self, budget=CONTEXT_TOKENS):
+        self.budget = budget
+        self.version = None
+        self.stats = {}
+        self.overview = []  # (line, tokens) of every class over all years, largest trends first
+        self.history_end = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        # Build the stats table on first use and again whenever a new snapshot is published
+        version = data_access.combined_version()
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self._build()
+                    self.version = version
+                    self.section.cache_clear()
+        return version
+
+    def _build(self):
+        layer = QueryLayer(data_access.load_combined())
+        forecast = data_access.load_forecast(columns=["Year", "yhat_lower", "yhat_upper", "Land_Cover_Type"])
+        intervals = {}
+        for row in forecast.itertuples(index=False):
+            intervals.setdefault(str(row.Land_Cover_Type), {})[int(row.Year)] = (float(row.yhat_lower), float(row.yhat_upper))
+        self.history_end = int(data_access.load_history(columns=["Year"])["Year"].max())
+        self.stats = {name: ClassStats(name, series, intervals.get(name, {})) for name, series in layer.series.items()}
+
+        # Overview of every class, ordered by the size of its trend so the budget keeps the most active ones
+        ranked = []
+        for name, stats in self.stats.items():
+            series = stats.series
+            line = stats.summary(int(series.years[0]), int(series.years[-1]), self.history_end)
+            ranked.append((abs(stats.slope(0, len(series.years))), line))
+        ranked.sort(key=lambda item: -np.nan_to_num(item[0]))
+        self.overview = [(line, estimate_tokens(line)) for _, line in ranked]
+
+    def build(self, dashboard_data):
+        # Data section for the prompt, within the token budget
+        self.refresh()
+        dashboard_data = dashboard_data or {}
+        land_cover = dashboard_data.get("land_cover")
+        try:
+            start_year, end_year = int(dashboard_data.get("start_year")), int(dashboard_data.get("end_year"))
+        except (TypeError, ValueError):
+            start_year = end_year = None
+        return self.section(self.version, land_cover if land_cover in self.stats else None, start_year, end_year, self.budget)
+
+    @lru_cache(maxsize=1024)
+    def section(self, version, land_cover, start_year, end_year, budget):
+        lines = [HEADER, f"Observed data ends in {self.history_end}; later years are forecasts."]
+        used = sum(estimate_tokens(line) for line in lines)
+        # The selected class over the selected range comes first
+        if land_cover and start_year is not None:
+            selected = self.stats[land_cover].summary(start_year, end_year, self.history_end)
+            if selected and used + estimate_tokens(selected) <= budget:
+                lines.append("Selected: " + selected)
+                used += estimate_tokens(selected) + 2
+        for line, tokens in self.overview:
+            if used + tokens > budget:
+                continue
+            lines.append(line)
+            used += tokens
+        return "\n".join(lines)
@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Chat requests run on a local thread pool so that no Dash worker waits on the LLM.
+# Job state lives in SQLite, so a poll can be answered by any worker process on the host.
+CHAT_URL = os.environ.get("CHAT_URL", "http://127.0.0.1:5000/chat")
+JOBS_PATH = os.environ.get("CHAT_JOBS_PATH", ".chat_jobs.sqlite")
+WORKERS = 8
+REQUEST_TIMEOUT = 60  # seconds for the HTTP call to the chat server
+JOB_TIMEOUT = 90  # seconds before a pending job is reported as timed out
+KEEP_SECONDS = 3600  # finished jobs are deleted after this long
+STREAM_FLUSH = 0.2  # seconds between partial answer writes while streaming
+
+PENDING = "pending"
+DONE = "done"
+ERROR = "error"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+
+
+class ChatJobs:
+
+    def __init__(self, path=JOBS_PATH, workers=WORKERS, chat_url=CHAT_URL,
+                 request_timeout=REQUEST_TIMEOUT, job_timeout=JOB_TIMEOUT):
+        self.path = path
+        self.chat_url = chat_url
+        self.request_timeout = request_timeout
+        self.job_timeout = job_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-job")
+        # Pooled keep-alive connections to the chat server
+        self.session = requests.Session()
+        self.futures = {}
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT, response TEXT, created REAL, updated REAL)"
+        )
+
+    def _connect(self):
+        # One connection per thread and process
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _finish(self, job_id, status, response):
+        # Only a pending job can finish; a cancelled or timed out job keeps its status
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, response = ?, updated = ? WHERE id = ? AND status = ?",
+            (status, response, time.time(), job_id, PENDING),
+        )
+
+    def submit(self, query, dashboard_data):
+        # Enqueue one chat request and return its job id immediately
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        connection = self._connect()
+        connection.execute("DELETE FROM jobs WHERE updated < ?", (now - KEEP_SECONDS,))
+        connection.execute("INSERT INTO jobs VALUES (?, ?, NULL, ?, ?)", (job_id, PENDING, now, now))
+        future = self.executor.submit(self._run, job_id, {"query": query, "dashboard_data": dashboard_data})
+        self.futures[job_id] = future
+        future.add_done_callback(lambda _: self.futures.pop(job_id, None))
+        return job_id
+
+    def _update_partial(self, job_id, response):
+        # Text streamed so far; False once the job is no longer pending (cancelled or timed out)
+        cursor = self._connect().execute(
+            "UPDATE jobs SET response = ?, updated = ? WHERE id = ? AND status = ?",
+            (response, time.time(), job_id, PENDING),
+        )
+        return cursor.rowcount > 0
+
+    def _run(self, job_id, payload):
+        if self.poll(job_id)[0] != PENDING:
+            return
+        try:
+            # Streaming servers (chat_server.py) answer with server-sent events, the Flask server with JSON
+            while True:
+                response = self.session.post(
+                    self.chat_url,
+                    json={**payload, "stream": True},
+                    headers={"Accept": "text/event-stream, application/json"},
+                    timeout=self.request_timeout,
+                    stream=True,
+                )
+                if response.status_code != 429:
+                    break
+                # Server is at capacity: wait as told, unless that runs past the job timeout
+                retry_after = float(response.headers.get("Retry-After", 1))
+                response.close()
+                if self.poll(job_id)[0] != PENDING or time.time() + retry_after > self._deadline(job_id):
+                    self._finish(job_id, TIMEOUT, "The AI is busy. Please try again.")
+                    return
+                time.sleep(retry_after)
+
+            with response:
+                if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    self._read_stream(job_id, response)
+                    return
+                data = response.json()
+            self._finish(job_id, DONE, data.get("response") or data.get("error") or "No response received from the AI.")
+        except requests.Timeout:
+            self._finish(job_id, TIMEOUT, "The AI took too long to answer. Please try again.")
+        except Exception as e:
+            self._finish(job_id, ERROR, f"Error contacting AI: {str(e)}")
+
+    def _read_stream(self, job_id, response):
+        # Store the partial answer at most every STREAM_FLUSH seconds so polls can show it
+        tokens = []
+        event = None
+        flushed = time.time()
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            data = json.loads(line[5:])
+            if event == "done":
+                self._finish(job_id, DONE, data.get("response") or "".join(tokens) or "No response received from the AI.")
+                return
+            if event == "error":
+                self._finish(job_id, ERROR, data.get("error", "Error contacting AI."))
+                return
+            tokens.append(data.get("token", ""))
+            if time.time() - flushed >= STREAM_FLUSH:
+                flushed = time.time()
+                if not self._update_partial(job_id, "".join(tokens)):
+                    return  # cancelled: closing the response stops the upstream generation
+        self._finish(job_id, DONE, "".join(tokens) or "No response received from the AI.")
+
+    def _deadline(self, job_id):
+        row = self._connect().execute("SELECT created FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return (row[0] if row else 0) + self.job_timeout
+
+    def poll(self, job_id):
+        # (status, response) of a job; a pending job's response is the text streamed so far.
+        # Pending jobs past JOB_TIMEOUT are reported as timed out
+        row = self._connect().execute("SELECT status, response, created FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return ERROR, "This chat request expired."
+        status, response, created = row
+        if status == PENDING and time.time() - created > self.job_timeout:
+            self._finish(job_id, TIMEOUT, "The AI took too long to answer. Please try again.")
+            self.cancel_future(job_id)
+            return TIMEOUT, "The AI took too long to answer. Please try again."
+        return status, response
+
+    def cancel(self, job_id):
+        self._finish(job_id, CANCELLED, "Cancelled.")
+        self.cancel_future(job_id)
+
+    def cancel_future(self, job_id):
+        # A job still queued in this process is dropped; one already running finishes
+        # its HTTP call, but its answer is discarded
+        future = self.futures.get(job_id)
+        if future is not None:
+            future.cancel()
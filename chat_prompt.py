@@ -0,0 +1,20 @@
+# Prompt and sampling settings shared by the Flask (ai_chatbot.py) and async (chat_server.py) chat servers
+MODEL = "gpt-3.5-turbo"
+MAX_TOKENS = 200
+TEMPERATURE = 0.7
+SYSTEM_PROMPT = "You are an AI assistant for land monitoring."
+
+
+def build_messages(user_query, dashboard_data, data_context=""):
+    # Prepare dynamic context; data_context is the dataset summary from chat_context.py
+    context = (
+        f"You are assisting with a land cover monitoring dashboard. "
+        f"The user is analyzing land cover data for {dashboard_data.get('land_cover', 'unknown land cover')} "
+        f"from {dashboard_data.get('start_year', 'unknown year')} to {dashboard_data.get('end_year', 'unknown year')}.\n\n"
+        + (f"{data_context}\nBase numeric answers on these facts.\n\n" if data_context else "")
+        + f"User Query: {user_query}"
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": context},
+    ]
@@ -0,0 +1,291 @@
+import argparse
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+import data_access
+from query_layer import QueryLayer
+
+# Answers numeric chat questions (a class at a year, change over a range, totals, averages,
+# extremes and rankings) straight from the combined dataset, so only open-ended questions
+# reach the LLM
+
+# Words that name a group of classes: pattern in the question -> substring of the class names
+CLASS_ALIASES = [
+    (r"forest", "Forest"),
+    (r"urban|built|city|cities", "Urban"),
+    (r"crop|agricultur|farm", "Crop"),
+    (r"grass", "Grassland"),
+    (r"shrub", "Shrubland"),
+    (r"savanna", "Savanna"),
+    (r"wetland|marsh|swamp", "Wetland"),
+    (r"snow|ice|glacier", "Snow"),
+    (r"barren|desert|bare", "Barren"),
+    (r"water|lake|river|ocean|sea\b|seas\b", "Water"),
+]
+# Land cover words with no class in this dataset; such questions go to the LLM rather
+# than being answered about the selected class
+OTHER_COVER = re.compile(r"\b(mangrove|tundra|peat|bog|moss|lichen|rock|sand|dune|reef|coral|beach|coast|pasture|orchard|vineyard|plantation|mine|quarr(?:y|ies))s?\b")
+
+# Questions asking for explanations or advice go to the LLM even when they mention numbers
+OPEN_ENDED = re.compile(r"\b(why|explain|reason|cause|caused|impact|effect|recommend|suggest|should|how can|what can)\b")
+RANKING = re.compile(r"\b(which|rank|ranking|top|most|least)\b")
+AGGREGATES = [
+    ("total", re.compile(r"\b(total|sum|cumulative|overall)\b")),
+    ("mean", re.compile(r"\b(average|mean)\b")),
+    ("max", re.compile(r"\b(max|maximum|highest|peak|largest|biggest)\b")),
+    ("min", re.compile(r"\b(min|minimum|lowest|smallest)\b")),
+]
+CHANGE = re.compile(r"\b(chang\w*|trend\w*|increas\w*|decreas\w*|grow\w*|grew|decline\w*|declin\w*|shrink\w*|evolv\w*|expan\w*|loss|gain\w*|over the years|since)\b")
+VALUE = re.compile(r"\b(forecast\w*|value|cover|coverage|area|how much|what is|what's|level|predicted|projection)\b")
+YEAR = re.compile(r"\b(?:19|20)\d{2}\b")
+SINCE = re.compile(r"\b(since|from)\b")
+
+
+def fmt(value, signed=False):
+    return f"{value:+,.0f}" if signed else f"{value:,.0f}"
+
+
+class ChatRouter:
+
+    def __init__(self):
+        self.version = None
+        self.layer = None
+        self.history_end = None
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.resolved = 0
+        self.intents = {}
+        self.seconds = 0.0
+
+    def refresh(self):
+        # Index the dataset on first use and again whenever a new snapshot is published
+        version = data_access.combined_version()
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self.layer = QueryLayer(data_access.load_combined())
+                    self.history_end = int(data_access.load_history(columns=["Year"])["Year"].max())
+                    self.version = version
+        return self.layer
+
+    def classes_in(self, query):
+        # Class names written out in the question, else the classes of a group word (and its name)
+        matches = []
+        for land_cover in self.layer.classes:
+            name = land_cover.lower()
+            for candidate in (name, name.rstrip("s")):
+                position = query.find(candidate)
+                if position >= 0:
+                    matches.append((position, position + len(candidate), land_cover))
+                    break
+        # 'Savannas' inside 'Woody Savannas' is not a separate mention
+        matches = [m for m in matches if not any(o != m and o[0] <= m[0] and m[1] <= o[1] for o in matches)]
+        if matches:
+            return [land_cover for _, _, land_cover in sorted(matches)], None
+        for pattern, substring in CLASS_ALIASES:
+            if re.search(r"\b(?:" + pattern + ")", query):
+                return [land_cover for land_cover in self.layer.classes if substring in land_cover], substring
+        return [], None
+
+    def series(self, classes, start_year, end_year):
+        # Years and summed values of one or more classes over a year range
+        totals = {}
+        for land_cover in classes:
+            years, values = self.layer.window(land_cover, start_year, end_year)
+            for year, value in zip(years.tolist(), values.tolist()):
+                totals[year] = totals.get(year, 0.0) + value
+        years = np.array(sorted(totals), dtype=np.int32)
+        return years, np.array([totals[year] for year in years.tolist()])
+
+    def label(self, classes, group=None):
+        if len(classes) == 1:
+            return classes[0]
+        if group and len(classes) > 2:
+            return f"{group} ({len(classes)} classes combined)"
+        return f"{', '.join(classes[:-1])} and {classes[-1]} combined"
+
+    def kind(self, year):
+        return "forecast" if year > self.history_end else "observed"
+
+    def answer(self, query, dashboard_data):
+        # A text answer, or None when the question should go to the LLM
+        start = time.perf_counter()
+        self.queries += 1
+        try:
+            intent, text = self._answer(query, dashboard_data or {})
+        except (KeyError, ValueError):
+            intent, text = None, None
+        self.seconds += time.perf_counter() - start
+        if text is not None:
+            self.resolved += 1
+            self.intents[intent] = self.intents.get(intent, 0) + 1
+        return text
+
+    def _answer(self, query, dashboard_data):
+        query = " ".join(query.lower().split())
+        if OPEN_ENDED.search(query):
+            return None, None
+        layer = self.refresh()
+        first_year = min(int(series.years[0]) for series in layer.series.values())
+        last_year = max(int(series.years[-1]) for series in layer.series.values())
+
+        years = sorted({int(year) for year in YEAR.findall(query)})
+        for year in years:
+            if not first_year <= year <= last_year:
+                return "out_of_range", f"There is no data for {year}; the dataset covers {first_year}-{last_year}."
+        # 'since 2010' / 'from 2010' is the range from that year to the end of the data
+        since = len(years) == 1 and bool(SINCE.search(query))
+        if len(years) >= 2:
+            start_year, end_year = years[0], years[-1]
+        elif since:
+            start_year, end_year = years[0], last_year
+        elif dashboard_data.get("start_year") and dashboard_data.get("end_year"):
+            start_year, end_year = int(dashboard_data["start_year"]), int(dashboard_data["end_year"])
+        else:
+            start_year, end_year = first_year, self.history_end
+
+        named, group = self.classes_in(query)
+        if not named and (group or OTHER_COVER.search(query)):
+            return None, None
+        aggregate = next((name for name, pattern in AGGREGATES if pattern.search(query)), None)
+        if not named and (RANKING.search(query) or aggregate in ("max", "min")):
+            return self.ranking(query, years, start_year, end_year, aggregate, last_year)
+
+        classes = named or ([dashboard_data["land_cover"]] if dashboard_data.get("land_cover") in layer.series else [])
+        if not classes:
+            return None, None
+        if aggregate == "total" and CHANGE.search(query):
+            aggregate = None  # 'total change' is the change over the range
+        if aggregate:
+            return self.aggregate(aggregate, classes, group, start_year, end_year)
+        if CHANGE.search(query) and (len(years) != 1 or since):
+            return self.change(classes, group, start_year, end_year)
+        if len(years) == 1 and (VALUE.search(query) or named):
+            return self.value(classes, group, years[0])
+        return None, None
+
+    def value(self, classes, group, year):
+        parts = [(land_cover, self.series([land_cover], year, year)[1]) for land_cover in classes]
+        parts = [(land_cover, float(values[0])) for land_cover, values in parts if len(values)]
+        if not parts:
+            return None, None
+        text = f"{self.label([p[0] for p in parts], group)} in {year} ({self.kind(year)}): {fmt(sum(v for _, v in parts))}."
+        if len(parts) > 1:
+            text += " By class: " + "; ".join(f"{land_cover} {fmt(v)}" for land_cover, v in parts) + "."
+        return "value", text
+
+    def change(self, classes, group, start_year, end_year):
+        years, values = self.series(classes, start_year, end_year)
+        if len(years) < 2:
+            return None, None
+        first, last = int(years[0]), int(years[-1])
+        per_year = (values[-1] - values[0]) / (last - first)
+        peak, low = int(np.argmax(values)), int(np.argmin(values))
+        text = (
+            f"{self.label(classes, group)} changed by {fmt(values[-1] - values[0], True)} from {first} ({fmt(values[0])}) "
+            f"to {last} ({fmt(values[-1])}, {self.kind(last)}), {fmt(per_year, True)} per year on average. "
+            f"Highest: {fmt(values[peak])} in {years[peak]}; lowest: {fmt(values[low])} in {years[low]}."
+        )
+        return "change", text
+
+    def aggregate(self, aggregate, classes, group, start_year, end_year):
+        years, values = self.series(classes, start_year, end_year)
+        if not len(years):
+            return None, None
+        span = f"{years[0]}-{years[-1]}"
+        if aggregate == "total":
+            text = f"Total for {self.label(classes, group)} over {span}: {fmt(values.sum())}."
+        elif aggregate == "mean":
+            text = f"Average for {self.label(classes, group)} over {span}: {fmt(values.mean())} per year."
+        else:
+            position = int(np.argmax(values) if aggregate == "max" else np.argmin(values))
+            word = "Highest" if aggregate == "max" else "Lowest"
+            text = f"{word} value of {self.label(classes, group)} over {span}: {fmt(values[position])} in {years[position]} ({self.kind(int(years[position]))})."
+        return aggregate, text
+
+    def ranking(self, query, years, start_year, end_year, aggregate, last_year):
+        # Classes ordered by their value at one year, or by their change over a range. A
+        # change question with a single year ('grew the most since 2010') runs to the last year.
+        ascending = aggregate == "min" or bool(re.search(r"\b(least|smallest|lowest|decreas\w*|declin\w*|loss)\b", query))
+        by_change = bool(CHANGE.search(query) or SINCE.search(query))
+        if len(years) == 1:
+            start_year, end_year = (years[0], last_year) if by_change else (years[0], years[0])
+        scores = []
+        for land_cover in self.layer.classes:
+            values = self.series([land_cover], start_year, end_year)[1]
+            if by_change and len(values) >= 2:
+                scores.append((values[-1] - values[0], land_cover))
+            elif not by_change and len(values):
+                scores.append((values[-1], land_cover))
+        if not scores:
+            return None, None
+        scores.sort(reverse=not ascending)
+        top = "; ".join(f"{land_cover} {fmt(score, by_change)}" for score, land_cover in scores[:3])
+        if by_change:
+            return "ranking", f"Largest {'decrease' if ascending else 'increase'} over {start_year}-{end_year}: {top}."
+        return "ranking", f"{'Lowest' if ascending else 'Highest'} values in {end_year} ({self.kind(end_year)}): {top}."
+
+    def stats(self):
+        return {
+            "queries": self.queries,
+            "resolved_locally": self.resolved,
+            "local_share": self.resolved / self.queries if self.queries else 0.0,
+            "intents": self.intents,
+            "mean_ms": 1000 * self.seconds / self.queries if self.queries else 0.0,
+            "dataset_version": self.version,
+        }
+
+
+# Questions with the intent and the start of the answer they must get ({last_year} is the
+# last year of the data; None means the question goes to the LLM). Run with --check.
+EXAMPLES = [
+    ("Which class grew the most since 2010?", "ranking", "Largest increase over 2010-{last_year}:"),
+    ("Which class declined the most since 2010?", "ranking", "Largest decrease over 2010-{last_year}:"),
+    ("Which class grew the most from 2005 to 2015?", "ranking", "Largest increase over 2005-2015:"),
+    ("Which class had the highest value in 2010?", "ranking", "Highest values in 2010 (observed):"),
+    ("How did croplands change since 2005?", "change", "Croplands changed by"),
+    ("Total change of urban from 2005 to 2010", "change", "Urban and Built-up changed by"),
+    ("What is the value of croplands in 2020?", "value", "Croplands in 2020 (observed):"),
+    ("What was the cover in 2090?", "out_of_range", "There is no data for 2090"),
+    ("How much water in 2020?", None, None),
+    ("How did mangroves change since 2005?", None, None),
+    ("Why did forests decline?", None, None),
+]
+EXAMPLE_DASHBOARD = {"land_cover": "Croplands", "start_year": 2001, "end_year": 2023}
+
+
+def check(router=None):
+    # Answer every example and report the ones that do not match; returns the failures
+    router = router or ChatRouter()
+    router.refresh()
+    last_year = max(int(series.years[-1]) for series in router.layer.series.values())
+    failures = 0
+    for query, intent, prefix in EXAMPLES:
+        got_intent, text = router._answer(query, EXAMPLE_DASHBOARD)
+        expected = prefix.format(last_year=last_year) if prefix else None
+        ok = got_intent == intent and (text is None if expected is None else text.startswith(expected))
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {query} -> {text if text is not None else '(LLM)'}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer chat questions from the combined dataset.")
+    parser.add_argument("query", nargs="*", help="Question to answer")
+    parser.add_argument("--check", action="store_true", help="Check the answers to the built-in example questions")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check()
+        print(f"{len(EXAMPLES) - failures}/{len(EXAMPLES)} examples answered as expected.")
+        sys.exit(1 if failures else 0)
+    answer = ChatRouter().answer(" ".join(args.query), EXAMPLE_DASHBOARD)
+    print(answer if answer is not None else "Not answered locally; this question goes to the LLM.")
+
+
+if __name__ == "__main__":
+    main()
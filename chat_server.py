@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+from aiohttp import web
+
+from chat_cache import ChatCache
+from chat_context import ChatContext
+from chat_prompt import MAX_TOKENS, MODEL, TEMPERATURE, build_messages
+from chat_router import ChatRouter
+from instrumentation import REGISTRY, add_aiohttp_routes, aiohttp_middleware, register_cache
+
+# Async version of ai_chatbot.py: one pooled upstream client, answers streamed back as
+# server-sent events, and a bounded number of concurrent LLM calls with a bounded queue
+# behind them (429 + Retry-After once the queue is full)
+LLM_URL = os.environ.get("LLM_URL", "https://api.openai.com/v1/chat/completions")
+MAX_CONCURRENCY = 16
+MAX_QUEUE = 64
+CONNECTIONS = 32
+UPSTREAM_TIMEOUT = 60  # seconds
+
+upstream_seconds = REGISTRY.summary("llm_upstream_seconds", "Time spent waiting for the LLM")
+first_token_seconds = REGISTRY.summary("llm_time_to_first_token_seconds", "Time until the LLM sent its first token")
+
+
+class Limiter:
+    # At most max_concurrency requests run; up to max_queue more wait for a slot
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.average_seconds = 1.0  # moving average of the request duration
+
+    def full(self):
+        return self.semaphore.locked() and self.waiting >= self.max_queue
+
+    def retry_after(self):
+        # Seconds until the queue has drained by one slot's worth of requests
+        return max(1, math.ceil(self.average_seconds * (self.waiting + 1) / self.max_concurrency))
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+            self.average_seconds = 0.8 * self.average_seconds + 0.2 * (time.perf_counter() - start)
+
+
+async def stream_completion(session, llm_url, messages):
+    # Yield the answer token by token from an OpenAI-compatible streaming endpoint
+    payload = {
+        "model": MODEL,
+        "messages": messages,
+        "max_tokens": MAX_TOKENS,
+        "temperature": TEMPERATURE,
+        "stream": True,
+    }
+    start = time.perf_counter()
+    first_token = True
+    try:
+        async with session.post(llm_url, json=payload) as response:
+            if response.status != 200:
+                raise RuntimeError(f"LLM returned {response.status}: {(await response.text())[:200]}")
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {})
+                if delta.get("content"):
+                    if first_token:
+                        first_token_seconds.observe(time.perf_counter() - start)
+                        first_token = False
+                    yield delta["content"]
+    finally:
+        upstream_seconds.observe(time.perf_counter() - start)
+
+
+def sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n".encode()
+
+
+async def send_answer(request, answer, streaming, headers):
+    # An answer that is already complete, as JSON or as a one-token event stream
+    if not streaming:
+        return web.json_response({"response": answer}, headers=headers)
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache", **headers})
+    await response.prepare(request)
+    await response.write(sse({"token": answer}) + sse({"response": answer}, "done"))
+    await response.write_eof()
+    return response
+
+
+async def home(request):
+    return web.Response(text="AI Chatbot API is running. Use the /chat endpoint for queries.")
+
+
+async def chat(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.json_response({"error": "Request body must be JSON."}, status=400)
+    if not isinstance(data, dict):
+        return web.json_response({"error": "Request body must be a JSON object."}, status=400)
+    user_query = data.get("query", "")
+    dashboard_data = data.get("dashboard_data") or {}
+
+    # Validate inputs
+    if not user_query or not isinstance(user_query, str):
+        return web.json_response({"error": "Missing 'query' field in the request."}, status=400)
+    if not isinstance(dashboard_data, dict):
+        return web.json_response({"error": "'dashboard_data' must be a JSON object."}, status=400)
+
+    streaming = data.get("stream") or "text/event-stream" in request.headers.get("Accept", "")
+
+    # Numeric questions are answered from the dataset
+    local = await asyncio.to_thread(request.app["router"].answer, user_query, dashboard_data)
+    if local is not None:
+        return await send_answer(request, local, streaming, {"X-Route": "local"})
+
+    chat_cache = request.app["chat_cache"]
+    cached = await asyncio.to_thread(chat_cache.lookup, user_query, dashboard_data)
+    if cached is not None:
+        return await send_answer(request, cached, streaming, {"X-Route": "llm", "X-Cache": "hit"})
+
+    # Local and cached answers are sent even when the LLM slots are full
+    limiter = request.app["limiter"]
+    if limiter.full():
+        retry_after = limiter.retry_after()
+        return web.json_response(
+            {"error": f"Too many chat requests, retry in {retry_after}s."},
+            status=429,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    # The queue place is taken right after the check, with no await in between, so
+    # concurrent requests cannot all pass it
+    session, llm_url = request.app["session"], request.app["llm_url"]
+    async with limiter.slot():
+        data_context = await asyncio.to_thread(request.app["context"].build, dashboard_data)
+        messages = build_messages(user_query, dashboard_data, data_context)
+        if not streaming:
+            try:
+                tokens = [token async for token in stream_completion(session, llm_url, messages)]
+            except Exception as e:
+                return web.json_response({"error": f"Server Error: {str(e)}"}, status=500)
+            answer = "".join(tokens)
+            await asyncio.to_thread(chat_cache.store, user_query, dashboard_data, answer)
+            return web.json_response({"response": answer}, headers={"X-Route": "llm", "X-Cache": "miss"})
+
+        # Each token as a 'data' event, then a 'done' event with the whole answer
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Route": "llm", "X-Cache": "miss"}
+        )
+        await response.prepare(request)
+        tokens = []
+        try:
+            async for token in stream_completion(session, llm_url, messages):
+                tokens.append(token)
+                await response.write(sse({"token": token}))
+            answer = "".join(tokens)
+            await asyncio.to_thread(chat_cache.store, user_query, dashboard_data, answer)
+            await response.write(sse({"response": answer}, "done"))
+        except (ConnectionResetError, asyncio.CancelledError):
+            # The client went away; leaving the block closes the upstream request too
+            raise
+        except Exception as e:
+            await response.write(sse({"error": f"Server Error: {str(e)}"}, "error"))
+        await response.write_eof()
+        return response
+
+
+async def cache_stats(request):
+    # Size and hit rate of the chat answer cache
+    return web.json_response(await asyncio.to_thread(request.app["chat_cache"].stats))
+
+
+async def router_stats(request):
+    # Share of chat questions answered from the dataset without the LLM
+    return web.json_response(request.app["router"].stats())
+
+
+def make_app(llm_url=LLM_URL, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE, connections=CONNECTIONS):
+    app = web.Application(middlewares=[aiohttp_middleware()])
+    app["router"] = ChatRouter()
+    app["context"] = ChatContext()
+    app["chat_cache"] = ChatCache()
+    app["llm_url"] = llm_url
+    app["limiter"] = limiter = Limiter(max_concurrency, max_queue)
+
+    # Queue depth, LLM slots in use and cache hit rates at /metrics
+    REGISTRY.gauge("chat_queue_depth", "Requests waiting for an LLM slot").set_function(lambda: limiter.waiting)
+    REGISTRY.gauge("chat_active_llm_requests", "LLM calls in flight").set_function(lambda: limiter.active)
+    REGISTRY.gauge("chat_local_answer_share", "Share of questions answered from the dataset").set_function(
+        lambda: app["router"].stats()["local_share"]
+    )
+    register_cache("chat_answers", app["chat_cache"].stats)
+
+    async def client_session(app):
+        # Keep-alive connections to the LLM, shared by every request
+        headers = {}
+        if os.getenv("OPENAI_API_KEY"):
+            headers["Authorization"] = f"Bearer {os.getenv('OPENAI_API_KEY')}"
+        app["session"] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connections, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=UPSTREAM_TIMEOUT),
+            headers=headers,
+        )
+        yield
+        await app["session"].close()
+
+    app.cleanup_ctx.append(client_session)
+    app.router.add_get("/", home)
+    app.router.add_post("/chat", chat)
+    app.router.add_get("/cache-stats", cache_stats)
+    app.router.add_get("/router-stats", router_stats)
+    add_aiohttp_routes(app)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the async, streaming chat server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--llm-url", default=LLM_URL, help="OpenAI-compatible chat completions URL")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="Requests waiting before 429")
+    parser.add_argument("--connections", type=int, default=CONNECTIONS, help="Upstream connection pool size")
+    args = parser.parse_args()
+
+    print(f"Chat server on http://{args.host}:{args.port}/chat -> {args.llm_url} "
+          f"({args.max_concurrency} concurrent, {args.max_queue} queued)")
+    web.run_app(
+        make_app(args.llm_url, args.max_concurrency, args.max_queue, args.connections),
+        host=args.host,
+        port=args.port,
+        print=None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Chat history kept on the server instead of in the browser. Every message is written to
+# SQLite (shared by the worker processes on the host); the recent messages of the most
+# active sessions are also held in a bounded in-memory LRU, checked against the session's
+# version so that a write from another process is never missed.
+SESSIONS_PATH = os.environ.get("CHAT_SESSIONS_PATH", ".chat_sessions.sqlite")
+MAX_SESSIONS = 256  # sessions held in memory
+MEMORY_MESSAGES = 50  # most recent messages held in memory per session
+KEEP_SECONDS = 7 * 24 * 3600  # idle sessions are deleted after this long
+
+
+class SessionStore:
+
+    def __init__(self, path=SESSIONS_PATH, max_sessions=MAX_SESSIONS, memory_messages=MEMORY_MESSAGES):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.memory_messages = memory_messages
+        self.memory = OrderedDict()  # session -> (version, [(seq, role, text, job), ...])
+        self._memory_lock = threading.Lock()
+        self._local = threading.local()
+        connection = self._connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, version INTEGER, updated REAL)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session TEXT, seq INTEGER, role TEXT, text TEXT, job TEXT, PRIMARY KEY (session, seq))"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS messages_job ON messages (job)")
+
+    def _connect(self):
+        # One connection per thread and process
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def create(self):
+        session = uuid.uuid4().hex
+        now = time.time()
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            stale = [row[0] for row in connection.execute("SELECT id FROM sessions WHERE updated < ?", (now - KEEP_SECONDS,))]
+            connection.executemany("DELETE FROM messages WHERE session = ?", [(s,) for s in stale])
+            connection.executemany("DELETE FROM sessions WHERE id = ?", [(s,) for s in stale])
+            connection.execute("INSERT INTO sessions VALUES (?, 0, ?)", (session, now))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return session
+
+    def _version(self, session):
+        row = self._connect().execute("SELECT version FROM sessions WHERE id = ?", (session,)).fetchone()
+        return row[0] if row else None
+
+    def _remember(self, session, version, messages):
+        with self._memory_lock:
+            self.memory[session] = (version, messages[-self.memory_messages:])
+            self.memory.move_to_end(session)
+            while len(self.memory) > self.max_sessions:
+                self.memory.popitem(last=False)
+
+    def append(self, session, role, text, job=None):
+        # Add a message and return its sequence number
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            seq = connection.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session = ?", (session,)).fetchone()[0]
+            connection.execute("INSERT INTO messages VALUES (?, ?, ?, ?, ?)", (session, seq, role, text, job))
+            connection.execute(
+                "INSERT INTO sessions VALUES (?, 1, ?) ON CONFLICT(id) DO UPDATE SET version = version + 1, updated = excluded.updated",
+                (session, time.time()),
+            )
+            version = connection.execute("SELECT version FROM sessions WHERE id = ?", (session,)).fetchone()[0]
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        with self._memory_lock:
+            cached = self.memory.get(session)
+        if cached is not None and cached[0] == version - 1:
+            self._remember(session, version, cached[1] + [(seq, role, text, job)])
+        return seq
+
+    def finish(self, job, text):
+        # Store the final answer of a background chat job
+        connection = self._connect()
+        row = connection.execute("SELECT session FROM messages WHERE job = ?", (job,)).fetchone()
+        if row is None:
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("UPDATE messages SET text = ? WHERE job = ?", (text, job))
+            connection.execute("UPDATE sessions SET version = version + 1, updated = ? WHERE id = ?", (time.time(), row[0]))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        with self._memory_lock:
+            self.memory.pop(row[0], None)
+
+    def messages(self, session, before=None, limit=MEMORY_MESSAGES):
+        # Up to limit messages preceding seq before (the latest ones when before is None), oldest first
+        version = self._version(session)
+        if version is None:
+            return []
+        if before is None and limit <= self.memory_messages:
+            with self._memory_lock:
+                cached = self.memory.get(session)
+                if cached is not None and cached[0] == version:
+                    self.memory.move_to_end(session)
+                    return cached[1][-limit:]
+        # The latest messages are always read as a full memory window, so the cached list is complete
+        count = limit if before is not None else max(limit, self.memory_messages)
+        rows = self._connect().execute(
+            "SELECT seq, role, text, job FROM messages WHERE session = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+            (session, before if before is not None else 2 ** 62, count),
+        ).fetchall()
+        rows.reverse()
+        if before is None:
+            self._remember(session, version, rows)
+        return rows[-limit:] if limit else []
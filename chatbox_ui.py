@@ -1,6 +1,11 @@
-from dash import dcc, html, callback_context  # Import callback_context directly
-from dash.dependencies import Input, Output, State
+import os
+from dash import Patch, dcc, html, callback_context, no_update  # Import callback_context directly
+from dash.dependencies import MATCH, Input, Output, State
+from dash.exceptions import PreventUpdate
 import requests
+from chat_jobs import CHAT_URL, PENDING, REQUEST_TIMEOUT, ChatJobs
+from chat_sessions import SessionStore
+from instrumentation import REGISTRY
 
 # Define the chatbox layout
 def get_chatbox_layout():
@@ -74,6 +79,7 @@ def get_chatbox_layout():
                             )
                         ],
                     ),
+                    get_load_earlier_button(),
                     # Chat messages
                     html.Div(
                         id="chatDisplay",
@@ -129,106 +135,255 @@ def get_chatbox_layout():
                             ),
                         ],
                     ),
+                    *get_chat_session_components(),
                 ],
             ),
         ],
     )
 
+# Chat bubble styles
+USER_BUBBLE_STYLE = {
+    "backgroundColor": "#007BFF",
+    "color": "white",
+    "borderRadius": "8px",
+    "padding": "10px",
+    "margin": "5px",
+    "alignSelf": "flex-end",
+    "maxWidth": "80%",
+}
+AI_BUBBLE_STYLE = {
+    "backgroundColor": "#555",
+    "color": "white",
+    "borderRadius": "8px",
+    "padding": "10px",
+    "margin": "5px",
+    "alignSelf": "flex-start",
+    "maxWidth": "80%",
+}
+
+# 'background' enqueues chat requests on a local worker pool and polls for the answer;
+# 'sync' calls the chat server inside the callback
+CHAT_MODE = os.environ.get("CHAT_MODE", "background")
+POLL_INTERVAL = 500  # milliseconds
+PENDING_TEXT = "Thinking..."
+
+# The chat display shows at most WINDOW messages; older ones are loaded PAGE at a time.
+# Children index 0 is the greeting, so messages start at index 1.
+WINDOW = 40
+PAGE = 20
+
+
+def get_chat_session_components():
+    # Session id (kept across page reloads of the tab) and the range of messages on screen
+    return [
+        dcc.Store(id="chat-session", storage_type="session"),
+        dcc.Store(id="chat-window", data={"first": None, "shown": 0}),
+    ]
+
+
+def get_load_earlier_button():
+    return html.Button(
+        "Show earlier messages",
+        id="chat-load-earlier",
+        style={"display": "none", "width": "100%", "backgroundColor": "#333", "color": "white", "border": "none"},
+    )
+
+
+CANCEL_STYLE = {
+    "marginTop": "5px",
+    "backgroundColor": "#333",
+    "color": "white",
+    "border": "1px solid #777",
+    "borderRadius": "5px",
+    "fontSize": "12px",
+}
+
+
+def pending_bubble(job_id, text=PENDING_TEXT):
+    # The answer polls its own job, and has its own Cancel button, so no callback needs
+    # the rest of the conversation
+    return html.Div(
+        [
+            html.Div(text, id={"type": "chat-answer", "index": job_id}),
+            dcc.Interval(id={"type": "chat-answer-poll", "index": job_id}, interval=POLL_INTERVAL),
+            html.Button("Cancel", id={"type": "chat-answer-cancel", "index": job_id}, style=CANCEL_STYLE),
+        ],
+        style=AI_BUBBLE_STYLE,
+    )
+
+
+def message_bubble(role, text, job=None):
+    if role == "user":
+        return html.Div(text, style=USER_BUBBLE_STYLE)
+    if job is not None and text == PENDING_TEXT:
+        return pending_bubble(job)
+    return html.Div(text, style=AI_BUBBLE_STYLE)
+
+
+def load_earlier_style(first):
+    return {"display": "block" if first else "none", "width": "100%", "backgroundColor": "#333", "color": "white", "border": "none"}
+
+
 # Define callback to toggle chatbox visibility
 def register_callbacks(app):
+    jobs = ChatJobs() if CHAT_MODE == "background" else None
+    sessions = SessionStore()
+    if jobs is not None:
+        REGISTRY.gauge("chat_jobs_in_flight", "Chat jobs queued or running in this process").set_function(lambda: len(jobs.futures))
+
+    app.clientside_callback(
+        """
+        function(n_clicks, style) {
+            if (!n_clicks) {
+                return window.dash_clientside.no_update;
+            }
+            return Object.assign({}, style, {display: style.display === "none" ? "block" : "none"});
+        }
+        """,
+        Output("chatbox", "style"),
+        Input("chat-icon", "n_clicks"),
+        State("chatbox", "style"),
+        prevent_initial_call=True,
+    )
+
     @app.callback(
         [
-            Output("chatbox", "style"),
             Output("chatDisplay", "children"),
+            Output("chat-window", "data"),
+            Output("chat-load-earlier", "style"),
+        ],
+        Input("chat-session", "data"),
+        State("chatDisplay", "children"),
+    )
+    def restore_chat(session, children):
+        # Show the latest messages of the tab's session after a page load
+        if callback_context.triggered_id is not None or not session:
+            raise PreventUpdate
+        messages = sessions.messages(session, limit=WINDOW)
+        if not messages:
+            raise PreventUpdate
+        greeting = (children or [])[:1]
+        return (
+            greeting + [message_bubble(role, text, job) for _, role, text, job in messages],
+            {"first": messages[0][0], "shown": len(messages)},
+            load_earlier_style(messages[0][0]),
+        )
+
+    @app.callback(
+        [
+            Output("chatDisplay", "children", allow_duplicate=True),
             Output("user-input", "value"),
+            Output("chat-window", "data", allow_duplicate=True),
+            Output("chat-load-earlier", "style", allow_duplicate=True),
+            Output("chat-session", "data"),
         ],
         [
-            Input("chat-icon", "n_clicks"),
             Input("send-button", "n_clicks"),
             Input("user-input", "n_submit"),
         ],
         [
-            State("chatbox", "style"),
             State("user-input", "value"),
-            State("chatDisplay", "children"),
             State("land-cover-dropdown", "value"),
             State("year-range-slider", "value"),
+            State("chat-session", "data"),
+            State("chat-window", "data"),
         ],
         prevent_initial_call=True,
     )
-    def handle_chat_interaction(
-        chat_icon_clicks, send_clicks, n_submit, current_style, user_query, chat_history, selected_land_cover, year_range
-    ):
-        ctx = callback_context  # Identify the triggering input
-        triggered_id = ctx.triggered[0]["prop_id"].split(".")[0] if ctx.triggered else None
-
-        # Ensure chat history is initialized
-        if not chat_history:
-            chat_history = []
-
-        # Toggle chatbox visibility
-        if triggered_id == "chat-icon":
-            if current_style.get("display") == "none":
-                return {**current_style, "display": "block"}, chat_history, None
-            else:
-                return {**current_style, "display": "none"}, chat_history, None
-
-        # Handle chat input (Send button or Enter key)
-        if triggered_id in ["send-button", "user-input"]:
-            if not user_query:
-                raise dash.exceptions.PreventUpdate
-
-            # Append user query to chat history
-            chat_history.append(
-                html.Div(
-                    user_query,
-                    style={
-                        "backgroundColor": "#007BFF",
-                        "color": "white",
-                        "borderRadius": "8px",
-                        "padding": "10px",
-                        "margin": "5px",
-                        "alignSelf": "flex-end",
-                        "maxWidth": "80%",
-                    },
-                )
-            )
+    def handle_chat_interaction(send_clicks, n_submit, user_query, selected_land_cover, year_range, session, window):
+        # Handle chat input (Send button or Enter key); only the new messages are sent back
+        if not user_query:
+            raise PreventUpdate
+        session = session or sessions.create()
+        window = window or {"first": None, "shown": 0}
+        dashboard_data = {
+            "start_year": year_range[0],
+            "end_year": year_range[1],
+            "land_cover": selected_land_cover,
+        }
+
+        # Append user query to chat history
+        new = [(sessions.append(session, "user", user_query), user_query)]
+        patch = Patch()
+        patch.append(message_bubble("user", user_query))
 
+        if jobs is not None:
+            # Enqueue the request and show a pending answer that polls for it
+            job_id = jobs.submit(user_query, dashboard_data)
+            new.append((sessions.append(session, "assistant", PENDING_TEXT, job_id), PENDING_TEXT))
+            patch.append(pending_bubble(job_id))
+        else:
             # Call the Flask API
             try:
                 response = requests.post(
-                    "http://127.0.0.1:5000/chat",
-                    json={
-                        "query": user_query,
-                        "dashboard_data": {
-                            "start_year": year_range[0],
-                            "end_year": year_range[1],
-                            "land_cover": selected_land_cover,
-                        },
-                    },
+                    CHAT_URL,
+                    json={"query": user_query, "dashboard_data": dashboard_data},
+                    timeout=REQUEST_TIMEOUT,
                 )
                 ai_response = response.json().get("response", "No response received from the AI.")
             except Exception as e:
                 ai_response = f"Error contacting AI: {str(e)}"
+            new.append((sessions.append(session, "assistant", ai_response), ai_response))
+            patch.append(message_bubble("assistant", ai_response))
 
-            # Append AI response to chat history
-            chat_history.append(
-                html.Div(
-                    ai_response,
-                    style={
-                        "backgroundColor": "#555",
-                        "color": "white",
-                        "borderRadius": "8px",
-                        "padding": "10px",
-                        "margin": "5px",
-                        "alignSelf": "flex-start",
-                        "maxWidth": "80%",
-                    },
-                )
-            )
+        # Keep at most WINDOW messages on screen
+        first = window["first"] if window["first"] is not None else new[0][0]
+        shown = window["shown"] + len(new)
+        while shown > WINDOW:
+            del patch[1]
+            first += 1
+            shown -= 1
+
+        # Clear the input field
+        return patch, "", {"first": first, "shown": shown}, load_earlier_style(first), session
+
+    @app.callback(
+        [
+            Output("chatDisplay", "children", allow_duplicate=True),
+            Output("chat-window", "data", allow_duplicate=True),
+            Output("chat-load-earlier", "style", allow_duplicate=True),
+        ],
+        Input("chat-load-earlier", "n_clicks"),
+        [State("chat-session", "data"), State("chat-window", "data")],
+        prevent_initial_call=True,
+    )
+    def load_earlier(n_clicks, session, window):
+        # Insert the PAGE messages before the first one on screen
+        if not session or not window or not window.get("first"):
+            raise PreventUpdate
+        messages = sessions.messages(session, before=window["first"], limit=PAGE)
+        if not messages:
+            raise PreventUpdate
+        patch = Patch()
+        for i, (_, role, text, job) in enumerate(messages):
+            patch.insert(1 + i, message_bubble(role, text, job))
+        first = messages[0][0]
+        return patch, {"first": first, "shown": window["shown"] + len(messages)}, load_earlier_style(first)
 
-            # Clear the input field
-            return current_style, chat_history, ""
+    if jobs is None:
+        return
 
-        # Default case: Prevent updates
-        raise dash.exceptions.PreventUpdate
+    @app.callback(
+        [
+            Output({"type": "chat-answer", "index": MATCH}, "children"),
+            Output({"type": "chat-answer-poll", "index": MATCH}, "disabled"),
+            Output({"type": "chat-answer-cancel", "index": MATCH}, "style"),
+        ],
+        [
+            Input({"type": "chat-answer-poll", "index": MATCH}, "n_intervals"),
+            Input({"type": "chat-answer-cancel", "index": MATCH}, "n_clicks"),
+        ],
+        prevent_initial_call=True,
+    )
+    def poll_chat_job(n_intervals, cancel_clicks):
+        # Show the text streamed so far, then the final answer; the poll stops (and the
+        # Cancel button of this answer disappears) once the job is done
+        job_id = callback_context.outputs_list[0]["id"]["index"]
+        status, response = jobs.poll(job_id)
+        if callback_context.triggered_id == {"type": "chat-answer-cancel", "index": job_id} and status == PENDING:
+            jobs.cancel(job_id)
+            status, response = jobs.poll(job_id)
+        if status == PENDING:
+            return response or no_update, no_update, no_update
+        sessions.finish(job_id, response)
+        return response, True, {"display": "none"}
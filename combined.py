@@ -1,22 +1,78 @@
+import argparse
+
 import pandas as pd
 
-# Load the processed data and forecast data
-df_processed = pd.read_csv("processed_land_cover_data.csv")  # Historical data (2001-2023)
-df_forecast = pd.read_csv("all_forecasted_land_cover.csv")  # Forecast data (2024-2033)
+import combined_store
+import data_access
+
+
+def build_combined(region=combined_store.DEFAULT_REGION):
+    # Historical data (2001-2023) and forecasts (2024-2033) as keyed rows of the combined
+    # store. Years stay integers and the forecast intervals are kept.
+    df_history = data_access.load_history()
+    df_history = pd.DataFrame({
+        "Source": "history",
+        "Region": region,
+        "Land_Cover_Type": df_history["Land_Cover_Type"].astype(str),
+        "Year": df_history["Year"],
+        "Value": df_history["Value"],
+        "Value_Lower": float("nan"),
+        "Value_Upper": float("nan"),
+    })
+
+    df_forecast = data_access.load_forecast(columns=["Year", "yhat", "yhat_lower", "yhat_upper", "Land_Cover_Type"])
+    df_forecast = pd.DataFrame({
+        "Source": "forecast",
+        "Region": region,
+        "Land_Cover_Type": df_forecast["Land_Cover_Type"].astype(str),
+        "Year": df_forecast["Year"],
+        "Value": df_forecast["yhat"],
+        "Value_Lower": df_forecast["yhat_lower"],
+        "Value_Upper": df_forecast["yhat_upper"],
+    })
+
+    return pd.concat([df_history, df_forecast], ignore_index=True)
+
+
+def export_csv(path=data_access.COMBINED_CSV, store_dir=combined_store.STORE_DIR):
+    # The current version in the Year, Land_Cover_Type, Value layout of combined_land_cover_data.csv
+    df_combined = data_access.load_combined(store_dir=store_dir)
+    df_combined.to_csv(path, index=False)
+    return df_combined
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append the historical and forecast data to the combined store.")
+    parser.add_argument("--region", default=combined_store.DEFAULT_REGION, help="Region the data covers")
+    parser.add_argument("--store-dir", default=combined_store.STORE_DIR)
+    parser.add_argument("--compact", action="store_true", help="Rewrite the current version as a single part")
+    parser.add_argument("--csv", default=data_access.COMBINED_CSV, help="CSV the current version is exported to")
+    parser.add_argument("--no-csv", action="store_true", help="Only update the store, without exporting the CSV")
+    args = parser.parse_args()
 
-# Melt the processed data for easier merging
-df_processed_melted = df_processed.melt(id_vars=["Year"], var_name="Land_Cover_Type", value_name="Value")
+    # Only rows that are new or changed since the current version are written
+    version = combined_store.append(build_combined(args.region), args.store_dir)
+    if version is None:
+        print(f"Combined store is up to date (version {combined_store.current_version(args.store_dir)}).")
+    else:
+        print(f"Combined store version {version}: {combined_store.read_manifest(args.store_dir)['rows']} rows appended.")
+    if args.compact:
+        version = combined_store.compact(args.store_dir)
+        print(f"Combined store compacted into version {version}.")
 
-# Rename the columns of forecast data for merging
-df_forecast.rename(columns={"ds": "Year", "yhat": "Value"}, inplace=True)
+    if combined_store.current_version(args.store_dir) is None:
+        print("Combined store is empty: no history or forecast rows were found.")
+        return
+    if args.no_csv:
+        df_combined = data_access.load_combined(store_dir=args.store_dir)
+    else:
+        df_combined = export_csv(args.csv, args.store_dir)
+        print(f"Combined data saved to '{args.csv}'.")
 
-# Combine the historical and forecast data
-df_combined = pd.concat([df_processed_melted, df_forecast[["Year", "Value", "Land_Cover_Type"]]])
+    # Check the combined data
+    print("Combined Data Preview:")
+    print(df_combined.head())
 
-# Save the combined data to a CSV file
-df_combined.to_csv("combined_land_cover_data.csv", index=False)
 
-# Check the combined data
-print("Combined data saved to 'combined_land_cover_data.csv'.")
-print("Combined Data Preview:")
-print(df_combined.head())
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parts are written as CSV instead
+    pa = None
+    pq = None
+
+# Append-only, versioned store of the dashboard dataset.
+#   parts/<version>.parquet   immutable rows appended by one version
+#   versions/<version>.json   manifest: the ordered list of parts making up that version
+#   CURRENT                   the latest version, replaced atomically
+# A reader resolves CURRENT once and only reads immutable files after that, so a writer
+# never exposes a half-written snapshot.
+STORE_DIR = "combined_store"
+CURRENT_FILE = "CURRENT"
+
+KEY_COLUMNS = ["Source", "Region", "Land_Cover_Type", "Year"]
+VALUE_COLUMNS = ["Value", "Value_Lower", "Value_Upper"]
+COLUMNS = KEY_COLUMNS + VALUE_COLUMNS + ["Version"]
+SOURCES = ["history", "forecast"]
+DEFAULT_REGION = "all"
+
+
+def _version_name(version):
+    return f"{version:06d}"
+
+
+def _write_atomic(path, write):
+    write(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def typed(df):
+    # int16 years, float32 values and categorical keys, as in data_access
+    df = df.copy()
+    df["Year"] = df["Year"].astype("int16")
+    df["Version"] = df["Version"].astype("int32")
+    for column in VALUE_COLUMNS:
+        df[column] = df[column].astype("float32")
+    df["Source"] = pd.Categorical(df["Source"], categories=SOURCES)
+    for column in ("Region", "Land_Cover_Type"):
+        df[column] = df[column].astype(str).astype("category")
+    return df[COLUMNS]
+
+
+def current_version(store_dir=STORE_DIR):
+    path = os.path.join(store_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return int(f.read().strip())
+
+
+def read_manifest(store_dir=STORE_DIR, version=None):
+    version = current_version(store_dir) if version is None else version
+    if version is None:
+        return None
+    with open(os.path.join(store_dir, "versions", _version_name(version) + ".json")) as f:
+        return json.load(f)
+
+
+def _read_part(store_dir, part):
+    path = os.path.join(store_dir, "parts", part)
+    if part.endswith(".parquet"):
+        return pq.read_table(path, memory_map=True).to_pandas()
+    return pd.read_csv(path)
+
+
+def resolve(df):
+    # Later parts override earlier ones for the same key. Forecasts are replaced as a
+    # whole: only the latest forecast run of each (Region, Land_Cover_Type) is kept.
+    df = df.drop_duplicates(subset=KEY_COLUMNS, keep="last")
+    forecast = df["Source"] == "forecast"
+    latest_run = df[forecast].groupby(["Region", "Land_Cover_Type"], observed=True)["Version"].transform("max")
+    stale = pd.Series(False, index=df.index)
+    stale[forecast] = df.loc[forecast, "Version"] != latest_run
+    return df[~stale].sort_values(["Land_Cover_Type", "Year", "Source"]).reset_index(drop=True)
+
+
+def prefer_history(df):
+    # One row per (Region, Land_Cover_Type, Year): history where it exists, else the forecast
+    df = df.sort_values(["Region", "Land_Cover_Type", "Year", "Source"])
+    return df.drop_duplicates(subset=["Region", "Land_Cover_Type", "Year"], keep="first").reset_index(drop=True)
+
+
+def read_snapshot(store_dir=STORE_DIR, version=None):
+    # Rows of one version (default: the current one), or None if the store is empty
+    manifest = read_manifest(store_dir, version)
+    if manifest is None:
+        return None
+    parts = [_read_part(store_dir, part) for part in manifest["parts"]]
+    return resolve(typed(pd.concat(parts, ignore_index=True)))
+
+
+def _changed_rows(new_df, current_df):
+    # Rows of new_df whose key is new or whose values differ from the current snapshot.
+    # A forecast that changes anywhere is appended in full for its (Region, Land_Cover_Type),
+    # because readers keep only the latest forecast run of each class.
+    if current_df is None or current_df.empty:
+        return new_df
+    keys = [new_df[column].astype(str) for column in KEY_COLUMNS]
+    current_keys = [current_df[column].astype(str) for column in KEY_COLUMNS]
+    current = current_df.set_index(pd.MultiIndex.from_arrays(current_keys))[VALUE_COLUMNS]
+    previous = current.reindex(pd.MultiIndex.from_arrays(keys))
+    same = np.ones(len(new_df), dtype=bool)
+    for column in VALUE_COLUMNS:
+        new_values = new_df[column].to_numpy(dtype="float32")
+        old_values = previous[column].to_numpy(dtype="float32")
+        same &= (new_values == old_values) | (np.isnan(new_values) & np.isnan(old_values))
+    changed = pd.Series(~same, index=new_df.index)
+
+    # Forecast classes that changed, or whose row set changed, are appended as a whole
+    forecast = new_df["Source"] == "forecast"
+    class_key = new_df["Region"].astype(str) + "\0" + new_df["Land_Cover_Type"].astype(str)
+    current_forecast = current_df[current_df["Source"] == "forecast"]
+    current_counts = (
+        current_forecast["Region"].astype(str) + "\0" + current_forecast["Land_Cover_Type"].astype(str)
+    ).value_counts()
+    new_counts = class_key[forecast].value_counts()
+    resized = set(new_counts.index[new_counts.ne(current_counts.reindex(new_counts.index))])
+    changed_classes = set(class_key[forecast & changed]) | resized
+    changed |= forecast & class_key.isin(changed_classes)
+    return new_df[changed.values]
+
+
+def append(rows_df, store_dir=STORE_DIR):
+    # Append the rows that differ from the current snapshot as one new part and publish a
+    # new version. Returns the new version, or None when nothing changed.
+    current = current_version(store_dir)
+    current_df = read_snapshot(store_dir) if current is not None else None
+    version = 1 if current is None else current + 1
+    rows_df = rows_df.copy()
+    rows_df["Version"] = version
+    changed_df = _changed_rows(typed(rows_df), current_df)
+    if changed_df.empty:
+        return None
+    return _publish(store_dir, version, changed_df, read_manifest(store_dir)["parts"] if current else [])
+
+
+def compact(store_dir=STORE_DIR):
+    # Rewrite the current snapshot as a single part under a new version
+    current = current_version(store_dir)
+    if current is None:
+        return None
+    return _publish(store_dir, current + 1, read_snapshot(store_dir), [])
+
+
+def _publish(store_dir, version, part_df, previous_parts):
+    os.makedirs(os.path.join(store_dir, "parts"), exist_ok=True)
+    os.makedirs(os.path.join(store_dir, "versions"), exist_ok=True)
+
+    name = _version_name(version)
+    part = name + (".parquet" if pq is not None else ".csv")
+    part_path = os.path.join(store_dir, "parts", part)
+    if pq is not None:
+        table = pa.Table.from_pandas(part_df, preserve_index=False)
+        _write_atomic(part_path, lambda path: pq.write_table(table, path))
+    else:
+        _write_atomic(part_path, lambda path: part_df.to_csv(path, index=False))
+
+    manifest = {
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rows": len(part_df),
+        "parts": previous_parts + [part],
+    }
+
+    def write_manifest(path):
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def write_current(path):
+        with open(path, "w") as f:
+            f.write(str(version))
+
+    _write_atomic(os.path.join(store_dir, "versions", name + ".json"), write_manifest)
+    _write_atomic(os.path.join(store_dir, CURRENT_FILE), write_current)
+    return version
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from pyhdf.SD import SD, SDC
+
+from ingest import BLOCK_ROWS, LC_LAYERS, find_granules
+
+# Cubes are stored pixel-interleaved as (row, col, year): the whole time series of a
+# pixel is contiguous, a block of rows holds every year, and a single year is a
+# zero-copy strided view.
+CUBE_LAYOUT = "row,col,year"
+
+
+def cube_paths(cube_dir, tile, layer):
+    tile_dir = os.path.join(cube_dir, tile)
+    return os.path.join(tile_dir, f"{layer}.u8"), os.path.join(tile_dir, f"{layer}.json")
+
+
+class LandCoverCube:
+    # Read-only view of one (tile, layer) cube and its metadata sidecar
+
+    def __init__(self, cube_dir, tile, layer="LC_Type1"):
+        data_path, meta_path = cube_paths(cube_dir, tile, layer)
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.tile = tile
+        self.layer = layer
+        self.years = self.meta["years"]
+        self.n_rows, self.n_cols, _ = self.meta["shape"]
+        self.data = np.memmap(data_path, dtype=np.uint8, mode="r", shape=tuple(self.meta["shape"]))
+
+    def year_index(self, year):
+        return self.years.index(year)
+
+    def year(self, year):
+        # Zero-copy (row, col) view of one year
+        return self.data[:, :, self.year_index(year)]
+
+    def iter_row_blocks(self, block_rows=BLOCK_ROWS):
+        # Zero-copy (rows, col, year) views, one block of rows at a time
+        for start in range(0, self.n_rows, block_rows):
+            yield start, self.data[start:min(start + block_rows, self.n_rows)]
+
+    def pixel_series(self, row, col):
+        # Contiguous read of every year of one pixel
+        return self.data[row, col]
+
+    def window_series(self, row_start, row_stop, col_start, col_stop):
+        # (rows, cols, year) view of a window; each row of the window is one contiguous read
+        return self.data[row_start:row_stop, col_start:col_stop]
+
+
+def open_cubes(cube_dir, layer="LC_Type1"):
+    # Every tile of the store that has a cube for this layer
+    cubes = {}
+    for tile in sorted(os.listdir(cube_dir)):
+        if os.path.exists(cube_paths(cube_dir, tile, layer)[1]):
+            cubes[tile] = LandCoverCube(cube_dir, tile, layer)
+    return cubes
+
+
+def _fill_rows(data_dir, file_names, layers, data_paths, shape, row_start, row_stop, reused):
+    # Worker entry point: fill one range of rows of every layer's cube. Years already in the
+    # previous cube are copied from it; only the others are decoded from their HDF file.
+    years = sorted(file_names)
+    hdf_files = {}
+    try:
+        for layer in layers:
+            cube = np.memmap(data_paths[layer], dtype=np.uint8, mode="r+", shape=shape)
+            old_path, old_shape, old_index = reused.get(layer, (None, None, {}))
+            if old_index:
+                old_cube = np.memmap(old_path, dtype=np.uint8, mode="r", shape=tuple(old_shape))
+                cube[row_start:row_stop, :, list(old_index)] = old_cube[row_start:row_stop][:, :, list(old_index.values())]
+                del old_cube
+            for year_index, year in enumerate(years):
+                if year_index in old_index:
+                    continue
+                if year not in hdf_files:
+                    hdf_files[year] = SD(os.path.join(data_dir, file_names[year]), SDC.READ)
+                sds = hdf_files[year].select(layer)
+                try:
+                    cube[row_start:row_stop, :, year_index] = sds[row_start:row_stop]
+                finally:
+                    sds.endaccess()
+            cube.flush()
+            del cube
+    finally:
+        for hdf_file in hdf_files.values():
+            hdf_file.end()
+
+
+def build_cubes(data_dir, cube_dir, layers=LC_LAYERS, block_rows=BLOCK_ROWS, workers=None, force=False):
+    # Decode the HDF granules into per-(tile, layer) memory-mapped cubes. When a tile's
+    # granules change (e.g. a new year arrives), the years whose granule is unchanged are
+    # copied from the previous cube instead of being decoded again.
+    granules = find_granules(data_dir)
+    tiles = sorted({tile for tile, _ in granules})
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for tile in tiles:
+            file_names = {year: name for (granule_tile, year), name in granules.items() if granule_tile == tile}
+            years = sorted(file_names)
+            sources = {str(year): file_names[year] for year in years}
+
+            # Skip cubes already built from exactly these granules; remember which years of
+            # the others can be reused
+            pending_layers = []
+            reused = {}
+            for layer in layers:
+                data_path, meta_path = cube_paths(cube_dir, tile, layer)
+                if not force and os.path.exists(meta_path):
+                    with open(meta_path) as f:
+                        old_meta = json.load(f)
+                    if old_meta.get("sources") == sources:
+                        continue
+                    old_sources = old_meta.get("sources", {})
+                    old_index = {
+                        year_index: old_meta["years"].index(year)
+                        for year_index, year in enumerate(years)
+                        if year in old_meta["years"] and old_sources.get(str(year)) == sources[str(year)]
+                    }
+                    reused[layer] = (data_path, old_meta["shape"], old_index)
+                pending_layers.append(layer)
+            if not pending_layers:
+                print(f"Cube up to date: {tile}")
+                continue
+
+            first_file = SD(os.path.join(data_dir, file_names[years[0]]), SDC.READ)
+            try:
+                sds = first_file.select(pending_layers[0])
+                try:
+                    n_rows, n_cols = sds.info()[2][:2]
+                finally:
+                    sds.endaccess()
+            finally:
+                first_file.end()
+            shape = (n_rows, n_cols, len(years))
+            reused = {layer: entry for layer, entry in reused.items() if list(entry[1][:2]) == [n_rows, n_cols]}
+
+            # The new cubes are written next to the old ones, which stay readable until they are replaced
+            os.makedirs(os.path.join(cube_dir, tile), exist_ok=True)
+            data_paths = {}
+            for layer in pending_layers:
+                data_path = cube_paths(cube_dir, tile, layer)[0] + ".tmp"
+                np.memmap(data_path, dtype=np.uint8, mode="w+", shape=shape).flush()
+                data_paths[layer] = data_path
+
+            futures = [
+                executor.submit(
+                    _fill_rows, data_dir, file_names, pending_layers, data_paths, shape,
+                    row_start, min(row_start + block_rows, n_rows), reused,
+                )
+                for row_start in range(0, n_rows, block_rows)
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+            for layer in pending_layers:
+                meta = {
+                    "tile": tile,
+                    "layer": layer,
+                    "years": years,
+                    "shape": list(shape),
+                    "dtype": "uint8",
+                    "layout": CUBE_LAYOUT,
+                    "sources": sources,
+                }
+                data_path, meta_path = cube_paths(cube_dir, tile, layer)
+                # Drop the old sidecar first so a cube is never opened with the wrong shape
+                if os.path.exists(meta_path):
+                    os.remove(meta_path)
+                os.replace(data_paths[layer], data_path)
+                with open(meta_path + ".tmp", "w") as f:
+                    json.dump(meta, f, indent=2)
+                os.replace(meta_path + ".tmp", meta_path)
+            decoded = len(years) - min(len(reused[layer][2]) if layer in reused else 0 for layer in pending_layers)
+            print(f"Built cube: {tile}, layers {pending_layers}, years {years[0]}-{years[-1]}, {decoded} year(s) decoded")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build memory-mapped land cover cubes from MCD12Q1 HDF files.")
+    parser.add_argument("data_dir", help="Directory containing the MCD12Q1 .hdf files")
+    parser.add_argument("--cube-dir", default="land_cover_cubes")
+    parser.add_argument("--layers", nargs="+", default=LC_LAYERS)
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="Rebuild cubes that are already up to date")
+    args = parser.parse_args()
+
+    build_cubes(args.data_dir, args.cube_dir, args.layers, args.block_rows, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
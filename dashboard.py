@@ -1,19 +1,93 @@
+import base64
+import os
+import threading
 import dash
-from dash import dcc, html
+import numpy as np
+from dash import Patch, callback_context, dcc, html
 import pandas as pd
 import plotly.express as px
+import plotly.io as pio
 import dash_bootstrap_components as dbc
 import dash_daq as daq
 from dash.dependencies import Input, Output, State
-from chatbox_ui import get_chatbox_layout, register_callbacks  # Import chatbox layout and callbacks
+from chatbox_ui import (  # Import chatbox layout and callbacks
+    get_chat_session_components,
+    get_chatbox_layout,
+    get_load_earlier_button,
+    register_callbacks,
+)
+from region_index import RegionIndex, load_regions
+from tile_pyramid import TilePyramid, register_tile_routes
+from flask import jsonify, request
+from functools import lru_cache
+from query_layer import QueryLayer
+from shared_cache import SharedCache, memoize
+import data_access
+import instrumentation
 import requests
 
 
-# Load the combined data (2001–2033)
-df_combined = pd.read_csv("combined_land_cover_data.csv")
+# Load the combined data (2001–2033) from the columnar data layer
+dataset_version = data_access.combined_version()
+df_combined = data_access.load_combined()
+
+# Per-class sorted arrays for year-range queries, and an LRU of built figures
+query_layer = QueryLayer(df_combined)
+FIGURE_CACHE_SIZE = 512
+
+# Callback results shared by every worker process on this host
+result_cache = SharedCache()
+dataset_lock = threading.Lock()
+
+
+def current_dataset_version():
+    # Reload the data when a new snapshot of the combined dataset is published; results
+    # cached for other snapshots are dropped
+    global dataset_version, df_combined, query_layer
+    version = data_access.combined_version()
+    if version != dataset_version:
+        with dataset_lock:
+            if version != dataset_version:
+                df_combined = data_access.load_combined()
+                query_layer = QueryLayer(df_combined)
+                dataset_version = version
+                result_cache.drop_other_versions(version)
+    return version
+
+
+# 'patch' sends only the changed traces after a graph's first render; 'full' always
+# sends whole figures. Series longer than WEBGL_THRESHOLD points are drawn with WebGL.
+UPDATE_MODE = os.environ.get("DASHBOARD_UPDATE_MODE", "patch")
+WEBGL_THRESHOLD = 1000
+
+# Callback response sizes, served at /payload-stats
+payload_stats = {}
+
+# Graphs whose template follows the theme toggle
+THEMED_GRAPHS = ["trend-line", "bar-chart", "scatter-plot", "map-visualization", "region-class-areas"]
+
+
+@lru_cache(maxsize=2)
+def figure_template(is_dark_mode):
+    return pio.templates["plotly_dark" if is_dark_mode else "plotly"].to_plotly_json()
+
+
+# Load the region index built by region_index.py (optional)
+try:
+    region_index = RegionIndex()
+except FileNotFoundError:
+    region_index = None
+regions = load_regions()
 
 # Initialize Dash app with Bootstrap for better aesthetics
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY], suppress_callback_exceptions=True)
+
+# Serve map tiles from the pyramid built by tile_pyramid.py (optional)
+try:
+    tile_pyramid = TilePyramid()
+    register_tile_routes(app.server, tile_pyramid)
+except FileNotFoundError:
+    tile_pyramid = None
 # Define styles for cards and elements
 card_style = {
     "margin": "10px",
@@ -147,6 +221,23 @@ app.layout = html.Div(
                         dcc.Graph(id="scatter-plot"),
                         html.H2("Map Visualization", style={"textAlign": "center", "marginTop": "30px"}),
                         dcc.Graph(id="map-visualization"),
+                        html.H2("Region Statistics", style={"textAlign": "center", "marginTop": "30px"}),
+                        html.Div(
+                            [
+                                dcc.Dropdown(
+                                    id="region-dropdown",
+                                    options=[{"label": name, "value": name} for name in regions],
+                                    placeholder="Select a region or enter a bounding box",
+                                    style={"width": "300px", "color": "black"},
+                                ),
+                                dcc.Input(id="bbox-lat-min", type="number", placeholder="Min latitude", debounce=True),
+                                dcc.Input(id="bbox-lat-max", type="number", placeholder="Max latitude", debounce=True),
+                                dcc.Input(id="bbox-lon-min", type="number", placeholder="Min longitude", debounce=True),
+                                dcc.Input(id="bbox-lon-max", type="number", placeholder="Max longitude", debounce=True),
+                            ],
+                            style={"display": "flex", "gap": "10px", "justifyContent": "center", "flexWrap": "wrap"},
+                        ),
+                        dcc.Graph(id="region-class-areas"),
                     ],
                     style={"padding": "20px"},
                 ),
@@ -227,6 +318,7 @@ app.layout = html.Div(
                                         ),
                                     ],
                                 ),
+                                get_load_earlier_button(),
                                 # Chat Display
                                 html.Div(
                                     id="chatDisplay",
@@ -291,6 +383,7 @@ app.layout = html.Div(
                                         ),
                                     ],
                                 ),
+                                *get_chat_session_components(),
                             ],
                         ),
                     ],
@@ -309,119 +402,324 @@ app.layout = html.Div(
             id='loading-interval',
             interval=4000,  # 4 seconds delay
             n_intervals=0,
+            max_intervals=1,  # Fire once, then stop
         ),
+        # Both figure templates, used by the client-side theme switch
+        dcc.Store(id="figure-templates", data={"dark": figure_template(True), "light": figure_template(False)}),
     ]
 )
 
-# Callback to update all graphs and metrics
-@app.callback(
+def typed_array(values):
+    # Plotly typed-array spec: base64 of the raw little-endian buffer instead of a JSON list
+    values = np.ascontiguousarray(values)
+    values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+    return {"dtype": f"{values.dtype.kind}{values.dtype.itemsize}", "bdata": base64.b64encode(values.tobytes()).decode()}
+
+
+def pyramid_version():
+    # Version of the tile pyramid, reloaded when it is rebuilt (None without a pyramid)
+    return tile_pyramid.refresh() if tile_pyramid is not None else None
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def build_map_layout(selected_land_cover, end_year, host_url, pyramid_version):
+    # Title and raster layers of the map; the only parts that change with the inputs.
+    # pyramid_version is part of the cache key because it is part of the tile URLs.
+    layers = []
+    title = f"Map Visualization for {selected_land_cover}"
+    if tile_pyramid is not None and tile_pyramid.years:
+        # Use the last observed year of the selected range
+        year = max([y for y in tile_pyramid.years if y <= end_year] or tile_pyramid.years[:1])
+        layers.append({
+            "sourcetype": "raster",
+            "source": [tile_pyramid.tile_url(year, selected_land_cover, host_url)],
+            "below": "traces",
+            "opacity": 0.8,
+        })
+        title += f" ({year})"
+    else:
+        title += " (tile pyramid not built)"
+    return title, layers
+
+
+def build_map_figure(selected_land_cover, end_year, is_dark_mode, host_url):
+    title, layers = build_map_layout(selected_land_cover, end_year, host_url, pyramid_version())
+    map_fig = {
+        "data": [{"type": "scattermap", "lat": [], "lon": []}],
+        "layout": {
+            "title": {"text": title},
+            "template": figure_template(is_dark_mode),
+            "map": {
+                "style": "carto-darkmatter" if is_dark_mode else "carto-positron",
+                "center": {"lat": 34.0, "lon": 10.0},  # Tunisia
+                "zoom": 5,
+                "layers": layers,
+            },
+            "uirevision": "map",  # Keep the user's pan/zoom when the figure is rebuilt
+            "height": 600,
+        },
+    }
+    return map_fig
+
+
+@memoize(result_cache, current_dataset_version, FIGURE_CACHE_SIZE)
+def build_trace(kind, selected_land_cover, start_year, end_year):
+    # The data trace and title of one graph. Large series use WebGL trace types, and
+    # arrays are sent as typed arrays.
+    years, values = query_layer.window(selected_land_cover, start_year, end_year)
+    scatter_type = "scattergl" if len(years) > WEBGL_THRESHOLD else "scatter"
+
+    if kind == "trend":
+        # Yearly Trend (Line Graph); WebGL lines do not support splines
+        trace = {"type": scatter_type, "mode": "lines", "line": {"shape": "spline" if scatter_type == "scatter" else "linear"}}
+        title = f"Yearly Trend for {selected_land_cover}"
+    elif kind == "bar":
+        # Bar Chart, bars colored by Value
+        trace = {
+            "type": "bar",
+            "marker": {
+                "color": typed_array(values.astype(np.float32)),
+                "colorscale": "Blues", "showscale": True, "colorbar": {"title": {"text": "Value"}},
+            },
+        }
+        title = f"Bar Chart for {selected_land_cover}"
+    else:
+        # Scatter Plot, points sized by |Value| and colored by Value
+        sizes = np.abs(values)
+        trace = {
+            "type": scatter_type,
+            "mode": "markers",
+            "marker": {
+                "color": typed_array(values.astype(np.float32)),
+                "colorscale": "Viridis", "showscale": True, "colorbar": {"title": {"text": "Value"}},
+                "size": typed_array(sizes.astype(np.float32)),
+                "sizemode": "area", "sizeref": 2.0 * max(sizes.max(initial=0), 1e-9) / 20 ** 2,
+            },
+        }
+        title = f"Scatter Plot for {selected_land_cover}"
+
+    trace.update({
+        "x": typed_array(years),
+        "y": typed_array(values),
+        "hovertemplate": "Year=%{x}<br>Area (sq. km)=%{y}<extra></extra>",
+    })
+    return trace, title
+
+
+def build_figure(kind, selected_land_cover, start_year, end_year, is_dark_mode):
+    # Plain figure dicts: no per-call validation, and the template is expanded only once
+    trace, title = build_trace(kind, selected_land_cover, start_year, end_year)
+    return {
+        "data": [trace],
+        "layout": {
+            "title": {"text": title},
+            "template": figure_template(is_dark_mode),
+            "xaxis": {"title": {"text": "Year"}},
+            "yaxis": {"title": {"text": "Area (sq. km)"}},
+            "margin": {"t": 60},
+        },
+    }
+
+
+def is_partial_update():
+    # The first call of a callback sends the whole figure; later calls patch the figure
+    # the browser already has
+    return UPDATE_MODE == "patch" and callback_context.triggered_id is not None
+
+
+# Hide the loading screen in the browser once the interval fires (it fires only once)
+app.clientside_callback(
+    """
+    function(n_intervals) {
+        if (!n_intervals) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update, window.dash_clientside.no_update];
+        }
+        return ["Data Loaded Successfully!", {"display": "none"}, {"display": "block"}];
+    }
+    """,
     [
-        Output("trend-line", "figure"),
-        Output("bar-chart", "figure"),
-        Output("scatter-plot", "figure"),
-        Output("map-visualization", "figure"),
-        Output("total-area", "children"),
-        Output("max-change", "children"),
-        Output("avg-change", "children"),
         Output("loading-output", "children"),
         Output("loading-screen", "style"),
         Output("dashboard-content", "style"),
     ],
+    Input("loading-interval", "n_intervals"),
+)
+
+# Swap the template of the figures already in the browser; no data is rebuilt
+app.clientside_callback(
+    """
+    function(isDarkMode, templates, ...figures) {
+        const template = isDarkMode ? templates.dark : templates.light;
+        return figures.map(function(figure) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            const layout = Object.assign({}, figure.layout, {template: template});
+            if (layout.map) {
+                layout.map = Object.assign({}, layout.map, {style: isDarkMode ? "carto-darkmatter" : "carto-positron"});
+            }
+            return Object.assign({}, figure, {layout: layout});
+        });
+    }
+    """,
+    [Output(graph_id, "figure", allow_duplicate=True) for graph_id in THEMED_GRAPHS],
+    Input("theme-toggle", "value"),
+    [State("figure-templates", "data")] + [State(graph_id, "figure") for graph_id in THEMED_GRAPHS],
+    prevent_initial_call=True,
+)
+
+
+# Each graph only depends on the inputs it uses; the theme is read as State so that a
+# theme toggle never reaches the server
+@app.callback(
     [
-        Input("land-cover-dropdown", "value"),
-        Input("year-range-slider", "value"),
-        Input("theme-toggle", "value"),
-        Input("loading-interval", "n_intervals"),
+        Output("total-area", "children"),
+        Output("max-change", "children"),
+        Output("avg-change", "children"),
     ],
+    [Input("land-cover-dropdown", "value"), Input("year-range-slider", "value")],
 )
-def update_graphs(selected_land_cover, selected_year_range, is_dark_mode, n_intervals):
-    # Show the dashboard after 4 seconds
-    if n_intervals > 0:
-        loading_screen_style = {"display": "none"}  # Hide the loading screen
-        dashboard_content_style = {"display": "block"}  # Show the dashboard content
-    else:
-        loading_screen_style = {"display": "flex"}  # Show the loading screen
-        dashboard_content_style = {"display": "none"}  # Hide the dashboard content
-
+def update_metrics(selected_land_cover, selected_year_range):
     start_year, end_year = selected_year_range
-    filtered_df = df_combined[
-        (df_combined["Land_Cover_Type"] == selected_land_cover)
-        & (df_combined["Year"] >= start_year)
-        & (df_combined["Year"] <= end_year)
-    ]
+    return build_metrics(selected_land_cover, start_year, end_year)
+
 
-    # Calculate metrics
-    total_area = filtered_df["Value"].sum()
-    max_change = filtered_df["Value"].max() - filtered_df["Value"].min()
-    avg_change = filtered_df["Value"].diff().mean()
+@memoize(result_cache, current_dataset_version, FIGURE_CACHE_SIZE)
+def build_metrics(selected_land_cover, start_year, end_year):
+    # Calculate metrics from the prefix sums and range tables of the selected class
+    total_area, max_change, avg_change = query_layer.metrics(selected_land_cover, start_year, end_year)
 
     # Format metrics
     total_area_text = f"{total_area:,.0f} sq. km"
     max_change_text = f"{max_change:+,.0f} sq. km"
     avg_change_text = f"{avg_change:+,.0f} sq. km/year"
+    return total_area_text, max_change_text, avg_change_text
 
-    # Yearly Trend (Line Graph)
-    trend_fig = px.line(
-        filtered_df,
-        x="Year",
-        y="Value",
-        title=f"Yearly Trend for {selected_land_cover}",
-        labels={"Value": "Area (sq. km)"},
-        template="plotly_dark" if is_dark_mode else "plotly",
-        line_shape="spline",
-    )
 
-    # Bar Chart (Updated Color)
-    bar_fig = px.bar(
-        filtered_df,
-        x="Year",
-        y="Value",
-        title=f"Bar Chart for {selected_land_cover}",
-        labels={"Value": "Area (sq. km)"},
-        template="plotly_dark" if is_dark_mode else "plotly",
-        color="Value",  # Color bars by Value
-        color_continuous_scale="Blues",  # Updated to a more appealing color
+def register_figure_callback(graph_id, kind):
+    # Traces are memoized on (type, class, range)
+    @app.callback(
+        Output(graph_id, "figure"),
+        [Input("land-cover-dropdown", "value"), Input("year-range-slider", "value")],
+        State("theme-toggle", "value"),
     )
+    def update_figure(selected_land_cover, selected_year_range, is_dark_mode):
+        start_year, end_year = selected_year_range
+        if not is_partial_update():
+            return build_figure(kind, selected_land_cover, start_year, end_year, is_dark_mode)
 
-    # Scatter Plot (Updated Color)
-    scatter_fig = px.scatter(
-        filtered_df,
-        x="Year",
-        y="Value",
-        title=f"Scatter Plot for {selected_land_cover}",
-        labels={"Value": "Area (sq. km)"},
-        template="plotly_dark" if is_dark_mode else "plotly",
-        size=filtered_df["Value"].abs(),
-        color="Value",  # Color points by Value
-        color_continuous_scale="Viridis",  # Updated to a professional color
-    )
+        # Only the trace and the title change; layout and template stay in the browser
+        trace, title = build_trace(kind, selected_land_cover, start_year, end_year)
+        patched_figure = Patch()
+        patched_figure["data"][0] = trace
+        patched_figure["layout"]["title"]["text"] = title
+        return patched_figure
+
+    return update_figure
+
+
+update_trend = register_figure_callback("trend-line", "trend")
+update_bar = register_figure_callback("bar-chart", "bar")
+update_scatter = register_figure_callback("scatter-plot", "scatter")
+
+
+@app.callback(
+    Output("map-visualization", "figure"),
+    [Input("land-cover-dropdown", "value"), Input("year-range-slider", "value")],
+    State("theme-toggle", "value"),
+)
+def update_map(selected_land_cover, selected_year_range, is_dark_mode):
+    # Map Visualization (raster tiles; pan/zoom only fetches tiles in the browser)
+    if not is_partial_update():
+        return build_map_figure(selected_land_cover, selected_year_range[1], is_dark_mode, request.host_url)
+
+    title, layers = build_map_layout(selected_land_cover, selected_year_range[1], request.host_url, pyramid_version())
+    patched_figure = Patch()
+    patched_figure["layout"]["title"]["text"] = title
+    patched_figure["layout"]["map"]["layers"] = layers
+    return patched_figure
+
+
+@app.server.after_request
+def record_payload_bytes(response):
+    # Report the size of every callback response, per set of outputs
+    if request.path.endswith("/_dash-update-component") and not response.direct_passthrough:
+        payload_bytes = len(response.get_data())
+        response.headers["X-Payload-Bytes"] = str(payload_bytes)
+        outputs = (request.get_json(silent=True) or {}).get("output", "")
+        stats = payload_stats.setdefault(outputs, {"responses": 0, "bytes": 0})
+        stats["responses"] += 1
+        stats["bytes"] += payload_bytes
+    return response
+
+
+@app.server.route("/cache-stats")
+def serve_cache_stats():
+    # Size and hit rate of the host-wide result cache (hits and misses of this process)
+    return jsonify({"dataset_version": dataset_version, **result_cache.stats()})
+
+
+@app.server.route("/payload-stats")
+def serve_payload_stats():
+    # Responses and bytes sent per callback output since the server started
+    return jsonify({
+        outputs: {**stats, "mean_bytes": stats["bytes"] / stats["responses"]}
+        for outputs, stats in payload_stats.items()
+    })
+
+
+def local_cache_stats(function):
+    info = function.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize}
 
-    # Map Visualization (Colorful markers)
-    map_fig = px.scatter_geo(
-        filtered_df,
-        lat=[34.0] * len(filtered_df),  # Example latitude for Tunisia
-        lon=[10.0] * len(filtered_df),  # Example longitude for Tunisia
-        size=filtered_df["Value"].abs(),  # Use absolute values for size
-        title=f"Map Visualization for {selected_land_cover}",
-        template="plotly_dark" if is_dark_mode else "plotly",
-        locationmode="ISO-3",
-        hover_name="Year",
-        color="Value",
-        color_continuous_scale="Viridis",
-    )
 
-    return (
-        trend_fig,
-        bar_fig,
-        scatter_fig,
-        map_fig,
-        total_area_text,
-        max_change_text,
-        avg_change_text,
-        "Data Loaded Successfully!",  # This is the text that appears in the loading screen
-        loading_screen_style,  # Hide the loading screen
-        dashboard_content_style,  # Show the dashboard content
+# Callback latency and payload size per callback, and cache hit rates, at /metrics
+# (and sampled stacks at /profile when PROFILE_INTERVAL is set)
+instrumentation.instrument_flask(app.server, labels_for=instrumentation.dash_callback_labels(app))
+instrumentation.register_cache("dashboard_results", result_cache.stats)
+instrumentation.register_cache("figures_in_process", lambda: local_cache_stats(build_trace))
+instrumentation.register_cache("metrics_in_process", lambda: local_cache_stats(build_metrics))
+
+
+# Callback to answer region queries from the block-histogram index
+@app.callback(
+    Output("region-class-areas", "figure"),
+    [
+        Input("region-dropdown", "value"),
+        Input("bbox-lat-min", "value"),
+        Input("bbox-lat-max", "value"),
+        Input("bbox-lon-min", "value"),
+        Input("bbox-lon-max", "value"),
+        Input("year-range-slider", "value"),
+    ],
+    State("theme-toggle", "value"),
+)
+def update_region_stats(selected_region, lat_min, lat_max, lon_min, lon_max, selected_year_range, is_dark_mode):
+    template = "plotly_dark" if is_dark_mode else "plotly"
+    if region_index is None or not region_index.refresh().years:
+        return px.bar(title="Region index not built (run region_index.py)", template=template)
+
+    # A named region takes precedence over the bounding box inputs
+    if selected_region in regions:
+        lat_min, lat_max, lon_min, lon_max = regions[selected_region]
+    if None in (lat_min, lat_max, lon_min, lon_max):
+        return px.bar(title="Select a region or enter a bounding box", template=template)
+
+    # Use the last observed year of the selected range
+    year = max([y for y in region_index.years if y <= selected_year_range[1]] or region_index.years[:1])
+    areas = region_index.class_areas(year, lat_min, lat_max, lon_min, lon_max)
+    region_df = pd.DataFrame({"Land_Cover_Type": list(areas), "Area": list(areas.values())})
+    return px.bar(
+        region_df.sort_values("Area"),
+        x="Area",
+        y="Land_Cover_Type",
+        orientation="h",
+        title=f"Land Cover Areas in {selected_region or 'Selected Box'} ({year})",
+        labels={"Area": "Area (sq. km)", "Land_Cover_Type": ""},
+        template=template,
     )
+
+
 from dash import callback_context
 # Register the chatbox callbacks
 try:
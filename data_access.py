@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import threading
+
+import pandas as pd
+
+import combined_store
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Fall back to parsing the CSV files on every load
+    pa = None
+    pq = None
+
+# Columnar copies of the CSV files, partitioned by Land_Cover_Type
+COLUMNAR_DIR = "columnar_data"
+
+HISTORY_CSV = "processed_land_cover_data.csv"
+FORECAST_CSV = "all_forecasted_land_cover.csv"
+COMBINED_CSV = "combined_land_cover_data.csv"
+
+# Serializes CSV -> columnar conversions between threads (e.g. concurrent pipeline stages)
+_convert_lock = threading.Lock()
+
+
+def _to_year(values):
+    # Integer years from either 2001 or '2024-01-01' style values
+    return values.astype(str).str[:4].astype("int16")
+
+
+def _convert_history(df):
+    # Wide (Year x class) table -> long table with one row per (Year, Land_Cover_Type)
+    df = df.melt(id_vars=["Year"], var_name="Land_Cover_Type", value_name="Value")
+    df["Year"] = _to_year(df["Year"])
+    return df
+
+
+def _convert_forecast(df):
+    df["Year"] = _to_year(df["ds"])
+    df["ds"] = pd.to_datetime(df["ds"])
+    return df
+
+
+def _convert_combined(df):
+    df["Year"] = _to_year(df["Year"])
+    return df
+
+
+# name -> (source CSV, conversion, column order)
+TABLES = {
+    "history": (HISTORY_CSV, _convert_history, ["Year", "Land_Cover_Type", "Value"]),
+    "forecast": (
+        FORECAST_CSV, _convert_forecast, ["ds", "Year", "yhat", "yhat_lower", "yhat_upper", "Land_Cover_Type"]
+    ),
+    "combined": (COMBINED_CSV, _convert_combined, ["Year", "Land_Cover_Type", "Value"]),
+}
+
+
+def _typed(df):
+    # Small integer years, float32 values and a categorical class column
+    df["Year"] = df["Year"].astype("int16")
+    for column in df.columns:
+        if column not in ("ds", "Year", "Land_Cover_Type"):
+            df[column] = df[column].astype("float32")
+    df["Land_Cover_Type"] = df["Land_Cover_Type"].astype("category")
+    return df
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"source": os.path.basename(csv_path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _columnar_path(name, columnar_dir):
+    return os.path.join(columnar_dir, name)
+
+
+def _is_fresh(name, csv_path, columnar_dir):
+    meta_path = os.path.join(_columnar_path(name, columnar_dir), "_source.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f) == _source_stamp(csv_path)
+
+
+def write_columnar(name, df, csv_path, columnar_dir=COLUMNAR_DIR):
+    # Write a typed table as a Parquet dataset partitioned by Land_Cover_Type
+    path = _columnar_path(name, columnar_dir)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    table = pa.Table.from_pandas(_typed(df.copy()), preserve_index=False)
+    pq.write_to_dataset(table, tmp_path, partition_cols=["Land_Cover_Type"])
+    with open(os.path.join(tmp_path, "_source.json"), "w") as f:
+        json.dump(_source_stamp(csv_path), f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def load_table(name, columns=None, land_cover=None, columnar_dir=COLUMNAR_DIR):
+    # Read one of TABLES, converting its CSV to the columnar store when it changed.
+    # Only the requested columns and Land_Cover_Type partitions are read.
+    csv_name, convert, column_order = TABLES[name]
+    columns = list(columns) if columns else column_order
+    if pq is None:
+        df = _typed(convert(pd.read_csv(csv_name))[column_order])
+        if land_cover is not None:
+            df = df[df["Land_Cover_Type"] == land_cover]
+        return df[columns]
+
+    with _convert_lock:
+        if not _is_fresh(name, csv_name, columnar_dir):
+            write_columnar(name, convert(pd.read_csv(csv_name))[column_order], csv_name, columnar_dir)
+
+    filters = [("Land_Cover_Type", "=", land_cover)] if land_cover is not None else None
+    table = pq.read_table(
+        _columnar_path(name, columnar_dir), columns=columns, filters=filters, memory_map=True
+    )
+    # Partition columns come back last; restore the requested column order
+    return table.to_pandas()[columns]
+
+
+def load_history(columns=None, land_cover=None):
+    # Historical yearly changes: Year, Land_Cover_Type, Value
+    return load_table("history", columns, land_cover)
+
+
+def load_history_wide():
+    # Same layout as processed_land_cover_data.csv (one column per class)
+    df = load_history()
+    wide = df.pivot(index="Year", columns="Land_Cover_Type", values="Value")
+    wide.columns = wide.columns.astype(str)
+    wide.columns.name = None
+    return wide.reset_index()
+
+
+def load_forecast(columns=None, land_cover=None):
+    # Forecasts: ds, Year, yhat, yhat_lower, yhat_upper, Land_Cover_Type
+    return load_table("forecast", columns, land_cover)
+
+
+def load_combined(columns=None, land_cover=None, store_dir=combined_store.STORE_DIR):
+    # Dashboard dataset: Year, Land_Cover_Type, Value. Read from the current version of the
+    # combined store (which also has Source, Region, Value_Lower and Value_Upper), or from
+    # combined_land_cover_data.csv when no store has been built. Years with history data
+    # show it instead of an older forecast.
+    if combined_store.current_version(store_dir) is None:
+        return load_table("combined", columns, land_cover)
+    df = combined_store.prefer_history(combined_store.read_snapshot(store_dir))
+    if land_cover is not None:
+        df = df[df["Land_Cover_Type"] == land_cover].reset_index(drop=True)
+    return df[list(columns) if columns else TABLES["combined"][2]]
+
+
+def combined_version(store_dir=combined_store.STORE_DIR):
+    # Identifies the current snapshot of the dashboard dataset; changes whenever the
+    # combined store publishes a version or the combined CSV is rewritten
+    version = combined_store.current_version(store_dir)
+    if version is not None:
+        return f"store-{version}"
+    stat = os.stat(COMBINED_CSV)
+    return f"csv-{stat.st_mtime_ns}-{stat.st_size}"
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+# Lightweight forecasters fitted to every series at once as array operations.
+# Intervals are empirical: quantiles of the in-sample one-step errors, widened by
+# sqrt(h) for a horizon of h years. INTERVAL_WIDTH matches Prophet's default.
+INTERVAL_WIDTH = 0.8
+FAST_MODELS = ["drift", "holt", "damped"]
+
+# Smoothing parameter grid searched for every series simultaneously
+ALPHAS = np.array([0.1, 0.2, 0.3, 0.5, 0.7, 0.9])
+BETAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5])
+DAMPING = np.array([0.8, 0.85, 0.9, 0.95, 0.98])
+
+
+def _drift(y, periods):
+    # Random walk with drift: last value plus the mean historical step
+    steps = np.diff(y, axis=1)
+    drift = steps.mean(axis=1, keepdims=True)
+    residuals = steps - drift
+    horizon = np.arange(1, periods + 1)
+    return y[:, -1:] + drift * horizon, residuals
+
+
+def _holt_pass(y, alpha, beta, phi, keep_residuals=False):
+    # One pass of Holt's recursions; parameters broadcast against (n_series, n_combinations)
+    shape = np.broadcast(y[:, :1], alpha).shape
+    level = np.broadcast_to(y[:, :1], shape).copy()
+    trend = np.broadcast_to(y[:, 1:2] - y[:, :1], shape).copy()
+    sse = np.zeros(shape)
+    residuals = []
+    for t in range(1, y.shape[1]):
+        prediction = level + phi * trend
+        error = y[:, t:t + 1] - prediction
+        sse += error ** 2
+        if keep_residuals:
+            residuals.append(error)
+        new_level = prediction + alpha * error
+        trend = phi * trend + beta * (new_level - level - phi * trend)
+        level = new_level
+    return level, trend, sse, residuals
+
+
+def _holt(y, periods, phis):
+    # Holt's linear trend (phi = 1) or damped trend (phi < 1). Every (alpha, beta, phi)
+    # combination is run for all series at once; each series keeps the combination with
+    # the lowest one-step squared error, then a second pass records its residuals.
+    alpha, beta, phi = (grid.ravel() for grid in np.meshgrid(ALPHAS, BETAS, phis, indexing="ij"))
+    _, _, sse, _ = _holt_pass(y, alpha[None, :], beta[None, :], phi[None, :])
+    best = np.argmin(sse, axis=1)
+    alpha, beta, phi = alpha[best][:, None], beta[best][:, None], phi[best][:, None]
+    level, trend, _, residuals = _holt_pass(y, alpha, beta, phi, keep_residuals=True)
+
+    # Sum of phi**1..phi**h for every horizon h
+    horizon = np.arange(1, periods + 1)[None, :]
+    damped_steps = np.cumsum(phi ** horizon, axis=1)
+    return level + damped_steps * trend, np.hstack(residuals)
+
+
+def forecast_matrix(y, periods, model="damped", interval_width=INTERVAL_WIDTH):
+    # y: (n_series, n_years) -> yhat, yhat_lower, yhat_upper, each (n_series, periods)
+    y = np.asarray(y, dtype=float)
+    if model == "drift":
+        yhat, residuals = _drift(y, periods)
+    elif model == "holt":
+        yhat, residuals = _holt(y, periods, np.array([1.0]))
+    elif model == "damped":
+        yhat, residuals = _holt(y, periods, DAMPING)
+    else:
+        raise ValueError(f"Unknown fast model: {model}")
+
+    # Skip the first residuals, dominated by the initial level and trend
+    residuals = residuals[:, min(2, residuals.shape[1] - 1):]
+    tail = (1 - interval_width) / 2
+    lower_q = np.quantile(residuals, tail, axis=1)[:, None]
+    upper_q = np.quantile(residuals, 1 - tail, axis=1)[:, None]
+    spread = np.sqrt(np.arange(1, periods + 1))[None, :]
+    return yhat, yhat + lower_q * spread, yhat + upper_q * spread
+
+
+def forecast_frame(series, periods, model="damped"):
+    # Long DataFrame in the all_forecasted_land_cover.csv schema for series built by
+    # forecasting.build_series (all sharing the same years), built without a per-series loop
+    names = sorted(series)
+    y = np.vstack([series[name]["y"].values for name in names])
+    yhat, lower, upper = forecast_matrix(y, periods, model)
+
+    last_ds = series[names[0]]["ds"].max()
+    future_ds = pd.date_range(last_ds, periods=periods + 1, freq="YS")[1:]
+    return pd.DataFrame({
+        "ds": np.tile(future_ds.values, len(names)),
+        "yhat": yhat.ravel(),
+        "yhat_lower": lower.ravel(),
+        "yhat_upper": upper.ravel(),
+        "Land_Cover_Type": np.repeat(names, periods),
+    })
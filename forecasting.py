@@ -0,0 +1,157 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.metadata import PackageNotFoundError, version
+
+import pandas as pd
+
+import data_access
+import fast_forecast
+
+# Fitted models and forecasts, keyed by a content hash of the series and parameters
+CACHE_DIR = "forecast_cache"
+FORECAST_COLUMNS = ["ds", "yhat", "yhat_lower", "yhat_upper", "Land_Cover_Type"]
+PERIODS = 10
+
+
+def forecast_file_name(land_cover_type):
+    # 'Cropland/Natural Vegetation Mosaic' -> 'Natural_Vegetation_Mosaic_forecast.csv'
+    return land_cover_type.split("/")[-1].replace(" ", "_") + "_forecast.csv"
+
+
+def build_series(history_df):
+    # {Land_Cover_Type: DataFrame(ds, y)} in the format Prophet expects
+    series = {}
+    for land_cover_type, group in history_df.groupby("Land_Cover_Type", observed=True):
+        group = group.sort_values("Year")
+        series[str(land_cover_type)] = pd.DataFrame({
+            "ds": pd.to_datetime(group["Year"].astype(str), format="%Y"),
+            "y": group["Value"].astype(float).values,
+        })
+    return series
+
+
+def series_hash(series_df, params, periods, backend="prophet"):
+    # Content hash of everything that determines a forecast
+    try:
+        backend_version = version(backend)
+    except PackageNotFoundError:
+        backend_version = None
+
+    payload = {
+        "ds": series_df["ds"].dt.strftime("%Y-%m-%d").tolist(),
+        "y": [repr(float(value)) for value in series_df["y"]],
+        "params": params,
+        "periods": periods,
+        "backend": backend,
+        "version": backend_version,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:24]
+
+
+def _fit_prophet(land_cover_type, series_df, params, periods, cache_dir, key):
+    # Worker entry point: fit one series and store the model and forecast in the cache
+    from prophet import Prophet
+    from prophet.serialize import model_to_json
+
+    logging.getLogger("cmdstanpy").setLevel(logging.WARNING)
+    model = Prophet(**params)
+    model.fit(series_df)
+    future = model.make_future_dataframe(periods=periods, freq="YS")
+    forecast = model.predict(future)
+
+    # Keep only the future years, as in all_forecasted_land_cover.csv
+    forecast = forecast[forecast["ds"] > series_df["ds"].max()].copy()
+    forecast["Land_Cover_Type"] = land_cover_type
+    forecast = forecast[FORECAST_COLUMNS]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{key}.model.json"), "w") as f:
+        f.write(model_to_json(model))
+    forecast.to_csv(os.path.join(cache_dir, f"{key}.csv.tmp"), index=False)
+    os.replace(os.path.join(cache_dir, f"{key}.csv.tmp"), os.path.join(cache_dir, f"{key}.csv"))
+    return forecast
+
+
+def load_params(params_file):
+    # {Land_Cover_Type: {prophet parameter: value}}, e.g. written by tuning.py
+    if not params_file:
+        return {}
+    with open(params_file) as f:
+        return json.load(f)
+
+
+def forecast_all(series, params_by_type=None, periods=PERIODS, workers=None, cache_dir=CACHE_DIR):
+    # Forecast every series in parallel, refitting only series whose hash is not cached
+    params_by_type = params_by_type or {}
+    forecasts = {}
+    pending = {}
+    for land_cover_type, series_df in series.items():
+        params = params_by_type.get(land_cover_type, {})
+        key = series_hash(series_df, params, periods)
+        cache_path = os.path.join(cache_dir, f"{key}.csv")
+        if os.path.exists(cache_path):
+            # Identical series share a cache entry, so the stored class name may be another one's
+            forecast = pd.read_csv(cache_path, parse_dates=["ds"])
+            forecast["Land_Cover_Type"] = land_cover_type
+            forecasts[land_cover_type] = forecast
+        else:
+            pending[land_cover_type] = (params, key)
+    print(f"Forecasts cached: {len(forecasts)}, to fit: {len(pending)}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                _fit_prophet, land_cover_type, series[land_cover_type], params, periods, cache_dir, key
+            ): land_cover_type
+            for land_cover_type, (params, key) in pending.items()
+        }
+        for future in as_completed(futures):
+            land_cover_type = futures[future]
+            forecasts[land_cover_type] = future.result()
+            print(f"Processed: {land_cover_type}")
+
+    return forecasts
+
+
+def write_forecasts(all_forecasts_df, output=None, refined_dir=None):
+    all_forecasts_df = all_forecasts_df.copy()
+    all_forecasts_df["ds"] = pd.to_datetime(all_forecasts_df["ds"]).dt.strftime("%Y-%m-%d")
+    if output:
+        all_forecasts_df.to_csv(output, index=False)
+        print(f"Forecasting completed and saved to {output}")
+    if refined_dir:
+        os.makedirs(refined_dir, exist_ok=True)
+        for land_cover_type, forecast in all_forecasts_df.groupby("Land_Cover_Type", sort=False):
+            forecast.to_csv(os.path.join(refined_dir, forecast_file_name(land_cover_type)), index=False)
+        print(f"Per-class forecasts saved to {refined_dir}/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forecast every land cover class.")
+    parser.add_argument("--backend", choices=["prophet", "fast"], default="prophet",
+                        help="'fast' fits NumPy models to all series at once instead of Prophet")
+    parser.add_argument("--fast-model", choices=fast_forecast.FAST_MODELS, default="damped",
+                        help="Model used by the fast backend")
+    parser.add_argument("--params-file", help="JSON of per-class Prophet parameters (e.g. best_params.json)")
+    parser.add_argument("--periods", type=int, default=PERIODS, help="Years to forecast")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--output", default="all_forecasted_land_cover.csv")
+    parser.add_argument("--refined-dir", help="Also write one CSV per class here (e.g. refined_forecasts)")
+    args = parser.parse_args()
+
+    series = build_series(data_access.load_history())
+    if args.backend == "fast":
+        all_forecasts_df = fast_forecast.forecast_frame(series, args.periods, args.fast_model)
+    else:
+        forecasts = forecast_all(series, load_params(args.params_file), args.periods, args.workers, args.cache_dir)
+        all_forecasts_df = pd.concat([forecasts[land_cover_type] for land_cover_type in sorted(forecasts)])
+    write_forecasts(all_forecasts_df, args.output, args.refined_dir)
+
+
+if __name__ == "__main__":
+    main()
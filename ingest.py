@@ -0,0 +1,284 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from pyhdf.SD import SD, SDC
+
+# Define land cover type mapping for human-readable names (LC_Type1, IGBP legend)
+land_cover_mapping = {
+    0: 'Water',
+    1: 'Evergreen Needleleaf Forest',
+    2: 'Evergreen Broadleaf Forest',
+    3: 'Deciduous Needleleaf Forest',
+    4: 'Deciduous Broadleaf Forest',
+    5: 'Mixed Forest',
+    6: 'Closed Shrublands',
+    7: 'Open Shrublands',
+    8: 'Woody Savannas',
+    9: 'Savannas',
+    10: 'Grasslands',
+    11: 'Permanent Wetlands',
+    12: 'Croplands',
+    13: 'Urban and Built-up',
+    14: 'Cropland/Natural Vegetation Mosaic',
+    15: 'Snow and Ice',
+    16: 'Barren or Sparsely Vegetated',
+    17: 'Unclassified',
+    18: 'Fill Value'
+}
+
+# All land cover layers of an MCD12Q1 granule, read in the same file pass
+LC_LAYERS = ["LC_Type1", "LC_Type2", "LC_Type3", "LC_Type4", "LC_Type5"]
+
+# Rows read per block: 240 rows x 2400 columns of uint8 is ~576 KB per layer
+BLOCK_ROWS = 240
+
+# Every SDS stores uint8 codes, so 256 bins cover all classes and fill values
+N_CODES = 256
+
+
+def parse_year(file_name):
+    # MCD12Q1.A2001001.h18v05.061.2022146083957.hdf -> 2001
+    return int(file_name.split('.')[1][1:5])
+
+
+def parse_tile(file_name):
+    # MCD12Q1.A2001001.h18v05.061.2022146083957.hdf -> 'h18v05'
+    return file_name.split('.')[2]
+
+
+def find_granules(data_dir):
+    # Map (tile, year) -> file name, keeping only the latest production of each granule
+    granules = {}
+    for file_name in sorted(os.listdir(data_dir)):
+        if not file_name.endswith('.hdf'):
+            continue
+        try:
+            key = (parse_tile(file_name), parse_year(file_name))
+        except (IndexError, ValueError):
+            print(f"Skipping unrecognised file name: {file_name}")
+            continue
+        # The production timestamp (5th field) sorts chronologically
+        if key in granules:
+            older, newer = sorted([granules[key], file_name], key=lambda name: name.split('.')[4])
+            print(f"Duplicate granule for tile {key[0]}, year {key[1]}: using {newer}, ignoring {older}")
+            granules[key] = newer
+        else:
+            granules[key] = file_name
+    return granules
+
+
+def iter_row_blocks(sds, block_rows=BLOCK_ROWS):
+    # Read the dataset one hyperslab of rows at a time instead of sds[:]
+    n_rows = sds.info()[2][0]
+    for start in range(0, n_rows, block_rows):
+        yield sds[start:min(start + block_rows, n_rows)]
+
+
+def count_classes(file_path, layers=LC_LAYERS, block_rows=BLOCK_ROWS):
+    # Reduce every requested layer of one HDF file to per-code pixel counts
+    hdf_file = SD(file_path, SDC.READ)
+    try:
+        counts = {}
+        for layer in layers:
+            sds = hdf_file.select(layer)
+            try:
+                layer_counts = np.zeros(N_CODES, dtype=np.int64)
+                for block in iter_row_blocks(sds, block_rows):
+                    layer_counts += np.bincount(block.ravel(), minlength=N_CODES)
+                counts[layer] = layer_counts
+            finally:
+                sds.endaccess()
+        return counts
+    finally:
+        hdf_file.end()
+
+
+def checkpoint_path(checkpoint_dir, file_name):
+    return os.path.join(checkpoint_dir, file_name + ".npz")
+
+
+def load_checkpoint(checkpoint_dir, file_name, layers):
+    # Return the saved counts of a granule, or None if it still has to be read
+    path = checkpoint_path(checkpoint_dir, file_name)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        if not all(layer in saved.files for layer in layers):
+            return None
+        return {layer: saved[layer] for layer in layers}
+
+
+def save_checkpoint(checkpoint_dir, file_name, counts):
+    # Write to a temporary file first so an interrupted run never leaves a partial checkpoint
+    path = checkpoint_path(checkpoint_dir, file_name)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **counts)
+    os.replace(tmp_path, path)
+
+
+def _count_granule(data_dir, file_name, layers, block_rows, checkpoint_dir):
+    # Worker entry point: count one granule and checkpoint the result
+    counts = count_classes(os.path.join(data_dir, file_name), layers, block_rows)
+    if checkpoint_dir:
+        save_checkpoint(checkpoint_dir, file_name, counts)
+    return counts
+
+
+def ingest_directory(data_dir, layers=LC_LAYERS, block_rows=BLOCK_ROWS, workers=None, checkpoint_dir=None):
+    # Count every granule across a process pool; results are keyed by (tile, year, layer)
+    granules = find_granules(data_dir)
+    totals = {}
+    pending = {}
+
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    for (tile, year), file_name in sorted(granules.items()):
+        counts = load_checkpoint(checkpoint_dir, file_name, layers) if checkpoint_dir else None
+        if counts is None:
+            pending[file_name] = (tile, year)
+            continue
+        for layer in layers:
+            totals[(tile, year, layer)] = counts[layer]
+        print(f"Resumed from checkpoint: {file_name}, Tile: {tile}, Year: {year}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_count_granule, data_dir, file_name, layers, block_rows, checkpoint_dir): file_name
+            for file_name in pending
+        }
+        for future in as_completed(futures):
+            file_name = futures[future]
+            tile, year = pending[file_name]
+            try:
+                counts = future.result()
+            except Exception as e:
+                print(f"Error reading {file_name}:", e)
+                continue
+            for layer in layers:
+                totals[(tile, year, layer)] = counts[layer]
+            print(f"Processed file: {file_name}, Tile: {tile}, Year: {year}")
+
+    return totals
+
+
+def _count_cube(cube_dir, tile, layers, block_rows):
+    # Worker entry point: per-year counts of one tile straight from its cubes.
+    # Offsetting each year by 256 lets a single bincount count every year of a block.
+    from cube_store import LandCoverCube  # cube_store imports this module
+
+    counts = {}
+    for layer in layers:
+        cube = LandCoverCube(cube_dir, tile, layer)
+        year_offsets = np.arange(len(cube.years), dtype=np.uint16) * N_CODES
+        layer_counts = np.zeros(len(cube.years) * N_CODES, dtype=np.int64)
+        for _, block in cube.iter_row_blocks(block_rows):
+            layer_counts += np.bincount((block + year_offsets).ravel(), minlength=len(layer_counts))
+        for year, year_counts in zip(cube.years, layer_counts.reshape(len(cube.years), N_CODES)):
+            counts[(tile, year, layer)] = year_counts
+    return counts
+
+
+def ingest_cubes(cube_dir, layers=LC_LAYERS, block_rows=BLOCK_ROWS, workers=None):
+    # Same result as ingest_directory, read from a cube store built by cube_store.py
+    from cube_store import open_cubes  # cube_store imports this module
+
+    # Only the layers each tile has a cube for; other entries of cube_dir are ignored
+    tile_layers = {}
+    for layer in layers:
+        for tile in open_cubes(cube_dir, layer):
+            tile_layers.setdefault(tile, []).append(layer)
+    totals = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_count_cube, cube_dir, tile, tile_layers[tile], block_rows): tile
+            for tile in sorted(tile_layers)
+        }
+        for future in as_completed(futures):
+            totals.update(future.result())
+            print(f"Processed cube: {futures[future]}")
+    return totals
+
+
+def check_mosaic(totals):
+    # Warn about years that are missing some of the region's tiles
+    tiles_per_year = {}
+    for tile, year, _ in totals:
+        tiles_per_year.setdefault(year, set()).add(tile)
+    all_tiles = set().union(*tiles_per_year.values()) if tiles_per_year else set()
+    for year, tiles in sorted(tiles_per_year.items()):
+        missing = all_tiles - tiles
+        if missing:
+            print(f"Warning: year {year} is missing tiles {sorted(missing)}; region totals will be incomplete")
+
+
+def counts_to_frame(totals):
+    # Long table with one row per non-empty (Tile, Year, Layer, Code)
+    rows = []
+    for (tile, year, layer), layer_counts in sorted(totals.items()):
+        for code in np.flatnonzero(layer_counts):
+            rows.append((tile, year, layer, int(code), int(layer_counts[code])))
+    return pd.DataFrame(rows, columns=["Tile", "Year", "Layer", "Code", "Count"])
+
+
+def region_totals(counts_df):
+    # Merge the per-tile counts into totals for the whole region
+    return counts_df.groupby(["Year", "Layer", "Code"], as_index=False)["Count"].sum()
+
+
+def build_yearly_trends(counts_df, layer="LC_Type1"):
+    # Same table as df.groupby(['Year', 'Land_Cover_Name']).size().unstack().fillna(0),
+    # summed over every tile in counts_df
+    layer_df = counts_df[counts_df["Layer"] == layer].copy()
+    layer_df["Land_Cover_Name"] = layer_df["Code"].map(land_cover_mapping)
+    layer_df = layer_df.dropna(subset=["Land_Cover_Name"])
+    yearly_trends = (
+        layer_df.groupby(["Year", "Land_Cover_Name"])["Count"].sum().unstack().fillna(0).astype(float)
+    )
+    return yearly_trends
+
+
+def build_yearly_change(yearly_trends):
+    # Calculate yearly changes (processed_land_cover_data.csv)
+    return yearly_trends.diff().fillna(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream MCD12Q1 HDF files into per-class pixel counts.")
+    parser.add_argument("data_dir", nargs="?", help="Directory containing the MCD12Q1 .hdf files")
+    parser.add_argument("--cube-dir", help="Read from a cube store built by cube_store.py instead of the HDF files")
+    parser.add_argument("--layers", nargs="+", default=LC_LAYERS, help="SDS layers to count")
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS, help="Rows read per block")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--checkpoint-dir", default="ingest_checkpoints",
+                        help="Per-granule counts used to resume an interrupted run ('' to disable)")
+    parser.add_argument("--counts-output", default="land_cover_counts.csv")
+    parser.add_argument("--trends-output", default="yearly_trends.csv")
+    parser.add_argument("--output", default="processed_land_cover_data.csv")
+    args = parser.parse_args()
+    if not args.data_dir and not args.cube_dir:
+        parser.error("either data_dir or --cube-dir is required")
+
+    if args.cube_dir:
+        totals = ingest_cubes(args.cube_dir, args.layers, args.block_rows, args.workers)
+    else:
+        totals = ingest_directory(args.data_dir, args.layers, args.block_rows, args.workers, args.checkpoint_dir)
+    check_mosaic(totals)
+    counts_df = counts_to_frame(totals)
+    counts_df.to_csv(args.counts_output, index=False)
+    print(f"Class counts saved as '{args.counts_output}'")
+
+    yearly_trends = build_yearly_trends(region_totals(counts_df))
+    yearly_trends.to_csv(args.trends_output, index=True)
+    print(f"Yearly trends saved as '{args.trends_output}'")
+
+    yearly_change = build_yearly_change(yearly_trends)
+    yearly_change.to_csv(args.output, index=True)
+    print(f"Processed data saved as '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
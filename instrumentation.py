@@ -0,0 +1,347 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Request timing, payload sizes and server gauges in the Prometheus text format, plus an
+# opt-in sampling profiler. Metrics are per process: with several workers, each one
+# reports its own, and Prometheus sums them.
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOW = 4096  # most recent observations used for the quantiles of a summary
+PROFILE_INTERVAL = os.environ.get("PROFILE_INTERVAL")  # seconds between samples; unset disables profiling
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value == value else "NaN"
+
+
+class Metric:
+
+    def __init__(self, name, help, kind):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class CounterMetric(Metric):
+
+    def __init__(self, name, help):
+        super().__init__(name, help, "counter")
+        self.values = {}
+
+    def inc(self, value=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [("", labels, value) for labels, value in self.values.items()]
+
+
+class GaugeMetric(Metric):
+    # Values set directly, or read from functions when the metrics are scraped
+
+    def __init__(self, name, help):
+        super().__init__(name, help, "gauge")
+        self.values = {}
+        self.functions = []
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[_labels(labels)] = value
+
+    def inc(self, value=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+    def set_function(self, function, **labels):
+        self.functions.append((_labels(labels), function))
+
+    def samples(self):
+        with self._lock:
+            samples = [("", labels, value) for labels, value in self.values.items()]
+        for labels, function in self.functions:
+            try:
+                samples.append(("", labels, function()))
+            except Exception:
+                continue
+        return samples
+
+
+class SummaryMetric(Metric):
+    # Count and sum of every observation, quantiles over the last WINDOW of them
+
+    def __init__(self, name, help, window=WINDOW):
+        super().__init__(name, help, "summary")
+        self.window = window
+        self.series = {}  # labels -> [count, sum, recent observations]
+
+    def observe(self, value, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0, 0.0, deque(maxlen=self.window)]
+            series[0] += 1
+            series[1] += value
+            series[2].append(value)
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            series = [(labels, count, total, sorted(recent)) for labels, (count, total, recent) in self.series.items()]
+        for labels, count, total, recent in series:
+            for quantile in QUANTILES:
+                value = recent[min(len(recent) - 1, int(quantile * len(recent)))] if recent else float("nan")
+                samples.append(("", labels + (("quantile", str(quantile)),), value))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class _Timer:
+
+    def __init__(self, summary, labels):
+        self.summary = summary
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.summary.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help)
+            return metric
+
+    def counter(self, name, help):
+        return self._get(CounterMetric, name, help)
+
+    def gauge(self, name, help):
+        return self._get(GaugeMetric, name, help)
+
+    def summary(self, name, help):
+        return self._get(SummaryMetric, name, help)
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def register_cache(name, stats_function, registry=REGISTRY):
+    # Hits, misses, hit rate and size of a cache whose stats() returns hits/misses/entries/bytes
+    def read(key):
+        def value():
+            stats = stats_function()
+            if key == "hit_rate":
+                lookups = stats["hits"] + stats["misses"]
+                return stats["hits"] / lookups if lookups else 0.0
+            return stats[key]
+        return value
+
+    for key, help in (
+        ("hits", "Cache hits since the process started"),
+        ("misses", "Cache misses since the process started"),
+        ("hit_rate", "Share of cache lookups that hit"),
+        ("entries", "Entries in the cache"),
+        ("bytes", "Size of the cache in bytes"),
+    ):
+        registry.gauge(f"cache_{key}", help).set_function(read(key), cache=name)
+
+
+def http_metrics(registry=REGISTRY):
+    return (
+        registry.summary("http_request_duration_seconds", "Time to handle a request"),
+        registry.summary("http_response_bytes", "Size of the response body"),
+        registry.counter("http_requests_total", "Requests handled"),
+        registry.gauge("http_requests_in_flight", "Requests being handled"),
+    )
+
+
+def dash_callback_labels(app):
+    # Name a Dash callback request by the function and first output it updates
+    def labels(request):
+        if not request.path.endswith("/_dash-update-component"):
+            return None
+        output = (request.get_json(silent=True) or {}).get("output", "")
+        callback = app.callback_map.get(output, {}).get("callback")
+        first = re.sub(r"@[0-9a-f]+", "", output.strip(".").split("...")[0])
+        return {"callback": getattr(callback, "__name__", "clientside"), "output": first}
+    return labels
+
+
+def instrument_flask(server, registry=REGISTRY, labels_for=None):
+    # Time every request, count its bytes and serve /metrics (and /profile when profiling)
+    from flask import Response, g, request
+
+    duration, size, requests_total, in_flight = http_metrics(registry)
+
+    @server.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        in_flight.inc()
+
+    @server.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        labels = {"route": request.url_rule.rule if request.url_rule else "unmatched", "callback": "", "output": ""}
+        labels.update((labels_for(request) if labels_for else None) or {})
+        duration.observe(time.perf_counter() - start, **labels)
+        if not response.direct_passthrough:
+            size.observe(response.calculate_content_length() or len(response.get_data()), **labels)
+        requests_total.inc(route=labels["route"], status=str(response.status_code))
+        return response
+
+    @server.teardown_request
+    def finish_request(exc):
+        in_flight.dec()
+
+    server.add_url_rule("/metrics", "metrics", lambda: Response(registry.render(), content_type=CONTENT_TYPE))
+    profiler = start_profiler()
+    if profiler is not None:
+        server.add_url_rule("/profile", "profile", lambda: Response(profiler.collapsed(request.args.get("reset") == "1"), content_type="text/plain"))
+
+
+def aiohttp_middleware(registry=REGISTRY):
+    # The same request metrics for aiohttp applications
+    from aiohttp import web
+
+    duration, size, requests_total, in_flight = http_metrics(registry)
+
+    @web.middleware
+    async def middleware(request, handler):
+        start = time.perf_counter()
+        in_flight.inc()
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else "unmatched"
+        response = None
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            in_flight.dec()
+            labels = {"route": route, "callback": "", "output": ""}
+            duration.observe(time.perf_counter() - start, **labels)
+            requests_total.inc(route=route, status=str(status))
+            if response is not None:
+                # Streamed responses have been written by now; the others still hold their body
+                body = getattr(response, "body", None)
+                size.observe(response.body_length if response.prepared else len(body) if isinstance(body, bytes) else 0, **labels)
+
+    return middleware
+
+
+def add_aiohttp_routes(app, registry=REGISTRY):
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    app.router.add_get("/metrics", metrics)
+    profiler = start_profiler()
+    if profiler is not None:
+        async def profile(request):
+            return web.Response(text=profiler.collapsed(request.query.get("reset") == "1"))
+        app.router.add_get("/profile", profile)
+
+
+class SamplingProfiler(threading.Thread):
+    # Samples the stack of every thread at a fixed interval. collapsed() returns one
+    # 'frame;frame;frame count' line per stack, the input format of flamegraph.pl and speedscope.
+
+    def __init__(self, interval):
+        super().__init__(name="sampling-profiler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            samples = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                samples.append(";".join(reversed(stack)))
+            with self._lock:
+                self.stacks.update(samples)
+
+    def collapsed(self, reset=False):
+        with self._lock:
+            stacks = self.stacks
+            if reset:
+                self.stacks = Counter()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+_profiler = None
+
+
+def start_profiler(interval=None):
+    # Start the process-wide profiler when PROFILE_INTERVAL (or interval) is set
+    global _profiler
+    interval = interval or PROFILE_INTERVAL
+    if _profiler is None and interval:
+        _profiler = SamplingProfiler(float(interval))
+        _profiler.start()
+    return _profiler
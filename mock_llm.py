@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+# Local stand-in for the OpenAI chat completions API, with a configurable time to first
+# token and token rate, so the chat servers can be measured offline
+
+WORDS = (
+    "forest cover grassland cropland urban water barren savanna shrubland wetland trend "
+    "increase decrease forecast area region year change stable growth decline"
+).split()
+
+
+def make_tokens(messages, count, rng):
+    # Echo the question, then filler words up to count tokens
+    question = messages[-1]["content"].split("User Query:")[-1].strip() if messages else ""
+    tokens = [f"{word} " for word in question.split()][:count]
+    while len(tokens) < count:
+        tokens.append(f"{rng.choice(WORDS)} ")
+    return tokens
+
+
+def chunk(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+async def chat_completions(request):
+    settings = request.app["settings"]
+    body = await request.json()
+    model = body.get("model", "mock")
+    count = min(int(body.get("max_tokens") or settings["tokens"]), settings["tokens"])
+    tokens = make_tokens(body.get("messages", []), count, random.Random(json.dumps(body, sort_keys=True)))
+    completion_id = f"chatcmpl-mock-{time.time_ns()}"
+    delay = 1 / settings["tokens_per_second"]
+
+    await asyncio.sleep(settings["ttft"])
+    if not body.get("stream"):
+        await asyncio.sleep(delay * (len(tokens) - 1))
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"completion_tokens": len(tokens)},
+        })
+
+    # Server-sent events, one token per chunk
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    await response.write(f"data: {json.dumps(chunk(completion_id, model, {'role': 'assistant'}))}\n\n".encode())
+    for i, token in enumerate(tokens):
+        if i:
+            await asyncio.sleep(delay)
+        await response.write(f"data: {json.dumps(chunk(completion_id, model, {'content': token}))}\n\n".encode())
+    await response.write(f"data: {json.dumps(chunk(completion_id, model, {}, 'stop'))}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+def make_app(ttft, tokens_per_second, tokens):
+    app = web.Application()
+    app["settings"] = {"ttft": ttft, "tokens_per_second": tokens_per_second, "tokens": tokens}
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=100, help="Maximum tokens per answer")
+    args = parser.parse_args()
+
+    print(f"Mock LLM on http://{args.host}:{args.port}/v1 "
+          f"(first token after {args.ttft}s, {args.tokens_per_second} tokens/s, up to {args.tokens} tokens)")
+    web.run_app(make_app(args.ttft, args.tokens_per_second, args.tokens), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import combined_store
+import data_access
+
+# Fingerprints of every stage's inputs, outputs and settings from its last successful run
+STATE_FILE = ".pipeline_state.json"
+
+COUNTS_CSV = "land_cover_counts.csv"
+TRENDS_CSV = "yearly_trends.csv"
+TRANSITIONS_CSV = "land_cover_transitions.csv"
+RESULTS_CSV = "rmse_results.csv"
+
+
+class Stage:
+    # One step of the pipeline. Inputs and outputs are file or directory paths; a stage
+    # depends on every stage that produces one of its inputs. `settings` names the
+    # config entries that change its result.
+
+    def __init__(self, name, inputs, outputs, run, settings=()):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.settings = settings
+
+
+def run_ingest(config):
+    import ingest
+
+    # Per-granule checkpoints: only granules that are new or changed are decoded
+    totals = ingest.ingest_directory(
+        config["data_dir"], workers=config["workers"], checkpoint_dir=config["checkpoint_dir"]
+    )
+    ingest.check_mosaic(totals)
+    ingest.counts_to_frame(totals).to_csv(COUNTS_CSV, index=False)
+
+
+def run_aggregate(config):
+    import ingest
+
+    counts_df = pd.read_csv(COUNTS_CSV)
+    ingest.build_yearly_trends(ingest.region_totals(counts_df)).to_csv(TRENDS_CSV, index=True)
+
+
+def run_diff(config):
+    import ingest
+
+    yearly_trends = pd.read_csv(TRENDS_CSV, index_col="Year")
+    ingest.build_yearly_change(yearly_trends).to_csv(data_access.HISTORY_CSV, index=True)
+
+
+def run_forecast(config):
+    import fast_forecast
+    import forecasting
+
+    # Prophet fits are cached per series, so only classes whose series changed are refit
+    series = forecasting.build_series(data_access.load_history())
+    if config["backend"] == "fast":
+        all_forecasts_df = fast_forecast.forecast_frame(series, config["periods"], config["fast_model"])
+    else:
+        forecasts = forecasting.forecast_all(
+            series, forecasting.load_params(config["params_file"]), config["periods"], config["workers"]
+        )
+        all_forecasts_df = pd.concat([forecasts[land_cover_type] for land_cover_type in sorted(forecasts)])
+    forecasting.write_forecasts(all_forecasts_df, data_access.FORECAST_CSV)
+
+
+def run_combine(config):
+    import combined
+
+    # Appends only the rows that changed as a new version of the combined store, then
+    # exports the current version to combined_land_cover_data.csv
+    combined_store.append(combined.build_combined(), config["store_dir"])
+    combined.export_csv(data_access.COMBINED_CSV, config["store_dir"])
+
+
+def run_evaluate(config):
+    import calculate
+    from forecasting import build_series
+
+    actual_data = data_access.load_history()
+    forecasts = calculate.backtest(build_series(actual_data), config["evaluate_models"], workers=config["workers"])
+    calculate.score(calculate.align(actual_data, forecasts), ("Model", "Land_Cover_Type")).to_csv(
+        RESULTS_CSV, index=False
+    )
+
+
+def run_cubes(config):
+    import cube_store
+
+    # Tiles whose granules did not change are skipped by the cube store; for the others
+    # only new or changed years are decoded
+    cube_store.build_cubes(config["data_dir"], config["cube_dir"], workers=config["workers"])
+
+
+def run_transitions(config):
+    import transitions
+
+    results = transitions.compute_cube_transitions(config["cube_dir"], workers=config["workers"])
+    transitions.transitions_to_frame(results).to_csv(TRANSITIONS_CSV, index=False)
+
+
+def run_region_index(config):
+    import region_index
+
+    # Years whose source granule did not change are copied from the previous index
+    region_index.build_index(config["cube_dir"], config["index_dir"], workers=config["workers"])
+
+
+def run_tile_pyramid(config):
+    import tile_pyramid
+
+    # Tile-years whose source granule did not change are kept as they are
+    tile_pyramid.build_pyramid(config["cube_dir"], config["pyramid_dir"], workers=config["workers"])
+
+
+def build_stages(config):
+    stages = [
+        Stage("forecast", [data_access.HISTORY_CSV, config["params_file"]], [data_access.FORECAST_CSV],
+              run_forecast, ("backend", "fast_model", "periods")),
+        Stage("combine", [data_access.HISTORY_CSV, data_access.FORECAST_CSV], [config["store_dir"], data_access.COMBINED_CSV],
+              run_combine),
+        Stage("evaluate", [data_access.HISTORY_CSV], [RESULTS_CSV], run_evaluate, ("evaluate_models",)),
+    ]
+    if config["data_dir"]:
+        stages = [
+            Stage("ingest", [config["data_dir"]], [COUNTS_CSV], run_ingest),
+            Stage("aggregate", [COUNTS_CSV], [TRENDS_CSV], run_aggregate),
+            Stage("diff", [TRENDS_CSV], [data_access.HISTORY_CSV], run_diff),
+        ] + stages
+        if config["cubes"]:
+            stages += [
+                Stage("cubes", [config["data_dir"]], [config["cube_dir"]], run_cubes),
+                Stage("transitions", [config["cube_dir"]], [TRANSITIONS_CSV], run_transitions),
+                Stage("region_index", [config["cube_dir"]], [config["index_dir"]], run_region_index),
+                Stage("tile_pyramid", [config["cube_dir"]], [config["pyramid_dir"]], run_tile_pyramid),
+            ]
+    # Optional inputs that are not set (e.g. no --params-file) are dropped
+    for stage in stages:
+        stage.inputs = [path for path in stage.inputs if path]
+    return stages
+
+
+def fingerprint(path):
+    # Content hash of a file. Directories (raw HDF granules, cube stores) are too large to
+    # read on every run, so they are fingerprinted by the name, size and mtime of each file.
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                stat = os.stat(file_path)
+                digest.update(f"{os.path.relpath(file_path, path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_state(state_file=STATE_FILE):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state, state_file=STATE_FILE):
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def stage_signature(stage, config):
+    return {
+        "inputs": {path: fingerprint(path) for path in stage.inputs},
+        "settings": {key: config[key] for key in stage.settings},
+    }
+
+
+def is_up_to_date(stage, config, state):
+    previous = state.get(stage.name)
+    if previous is None or previous["signature"] != stage_signature(stage, config):
+        return False
+    # Outputs that were deleted or edited by hand are rebuilt
+    return all(previous["outputs"].get(path) == fingerprint(path) for path in stage.outputs)
+
+
+def run_pipeline(config, targets=None, force=False, jobs=4, state_file=STATE_FILE):
+    stages = {stage.name: stage for stage in build_stages(config)}
+    producers = {path: stage.name for stage in stages.values() for path in stage.outputs}
+    depends_on = {
+        name: {producers[path] for path in stage.inputs if path in producers and producers[path] != name}
+        for name, stage in stages.items()
+    }
+
+    # Only the requested stages and everything upstream of them
+    if targets:
+        selected = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in selected:
+                selected.add(name)
+                pending.extend(depends_on[name])
+        stages = {name: stage for name, stage in stages.items() if name in selected}
+
+    state = load_state(state_file)
+    done = set()
+    started = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(done) < len(stages):
+            # Stages whose upstream stages have all finished are checked, then run concurrently
+            for name, stage in stages.items():
+                if name in done or name in started or not (depends_on[name] & stages.keys()) <= done:
+                    continue
+                if not force and is_up_to_date(stage, config, state):
+                    print(f"[{name}] up to date")
+                    done.add(name)
+                    continue
+                missing = [path for path in stage.inputs if not os.path.exists(path)]
+                if missing:
+                    raise FileNotFoundError(f"Stage '{name}' is missing its inputs: {missing}")
+                print(f"[{name}] running")
+                started.add(name)
+                running[executor.submit(stage.run, config)] = (name, stage_signature(stage, config), time.perf_counter())
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, signature, start = running.pop(future)
+                future.result()
+                state[name] = {
+                    "signature": signature,
+                    "outputs": {path: fingerprint(path) for path in stages[name].outputs},
+                }
+                save_state(state, state_file)
+                done.add(name)
+                print(f"[{name}] done in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the land cover pipeline, skipping stages whose inputs are unchanged.")
+    parser.add_argument("targets", nargs="*", help="Stages to bring up to date (default: all)")
+    parser.add_argument("--data-dir", help="Directory containing the MCD12Q1 .hdf files (enables the ingest stages)")
+    parser.add_argument("--cubes", action="store_true",
+                        help="Also build the cube store, transitions, region index and tile pyramid")
+    parser.add_argument("--checkpoint-dir", default="ingest_checkpoints")
+    parser.add_argument("--store-dir", default=combined_store.STORE_DIR)
+    parser.add_argument("--cube-dir", default="land_cover_cubes")
+    parser.add_argument("--index-dir", default="region_index")
+    parser.add_argument("--pyramid-dir", default="tile_pyramid")
+    parser.add_argument("--backend", choices=["prophet", "fast"], default="prophet")
+    parser.add_argument("--fast-model", default="damped")
+    parser.add_argument("--params-file", help="JSON of per-class Prophet parameters (e.g. best_params.json)")
+    parser.add_argument("--periods", type=int, default=10, help="Years to forecast")
+    parser.add_argument("--evaluate-models", nargs="+", default=["drift", "holt", "damped"],
+                        help="Forecasters backtested by the evaluate stage")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes per stage (default: all cores)")
+    parser.add_argument("--jobs", type=int, default=4, help="Stages run at the same time")
+    parser.add_argument("--force", action="store_true", help="Rerun every selected stage")
+    parser.add_argument("--state-file", default=STATE_FILE)
+    args = parser.parse_args()
+
+    config = vars(args).copy()
+    stage_names = [stage.name for stage in build_stages(config)]
+    unknown = [name for name in args.targets if name not in stage_names]
+    if unknown:
+        parser.error(f"unknown stages {unknown}; available: {stage_names}")
+
+    run_pipeline(config, args.targets, args.force, args.jobs, args.state_file)
+
+
+if __name__ == "__main__":
+    main()
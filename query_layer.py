@@ -0,0 +1,70 @@
+import numpy as np
+
+
+def _sparse_table(values, reduce):
+    # levels[k][i] = reduce(values[i:i + 2**k]); any range is then two overlapping lookups
+    levels = [values]
+    width = 1
+    while 2 * width <= len(values):
+        previous = levels[-1]
+        levels.append(reduce(previous[:-width], previous[width:]))
+        width *= 2
+    return levels
+
+
+class ClassSeries:
+    # One land cover class as year-sorted arrays with prefix sums and range min/max tables
+
+    def __init__(self, years, values):
+        order = np.argsort(years, kind="stable")
+        self.years = np.ascontiguousarray(years[order])
+        self.values = np.ascontiguousarray(values[order], dtype=np.float64)
+        self.prefix = np.concatenate([[0.0], np.cumsum(self.values)])
+        self.max_table = _sparse_table(self.values, np.maximum)
+        self.min_table = _sparse_table(self.values, np.minimum)
+
+    def bounds(self, start_year, end_year):
+        # [start, stop) positions of the years in [start_year, end_year], by binary search
+        start = int(np.searchsorted(self.years, start_year, side="left"))
+        stop = int(np.searchsorted(self.years, end_year, side="right"))
+        return start, max(start, stop)
+
+    def _range(self, table, reduce, start, stop):
+        level = (stop - start).bit_length() - 1
+        return reduce(table[level][start], table[level][stop - (1 << level)])
+
+    def metrics(self, start, stop):
+        # Total, max - min and mean year-over-year difference of values[start:stop]
+        n = stop - start
+        if n == 0:
+            return 0.0, float("nan"), float("nan")
+        total = self.prefix[stop] - self.prefix[start]
+        spread = self._range(self.max_table, max, start, stop) - self._range(self.min_table, min, start, stop)
+        # The mean of consecutive differences telescopes to (last - first) / (n - 1)
+        mean_diff = (self.values[stop - 1] - self.values[start]) / (n - 1) if n > 1 else float("nan")
+        return float(total), float(spread), float(mean_diff)
+
+
+class QueryLayer:
+    # Year-range queries over the combined dataset, pre-partitioned per Land_Cover_Type
+
+    def __init__(self, df, value_column="Value"):
+        self.series = {}
+        for land_cover, group in df.groupby("Land_Cover_Type", observed=True, sort=False):
+            self.series[str(land_cover)] = ClassSeries(
+                group["Year"].to_numpy(dtype=np.int32), group[value_column].to_numpy(dtype=np.float64)
+            )
+        self.classes = list(self.series)
+        # A cleared dropdown (None) or a class missing from this snapshot selects no rows
+        self.empty = ClassSeries(np.empty(0, dtype=np.int32), np.empty(0))
+
+    def window(self, land_cover, start_year, end_year):
+        # Zero-copy (years, values) views of one class over a year range
+        series = self.series.get(land_cover, self.empty)
+        start, stop = series.bounds(start_year, end_year)
+        return series.years[start:stop], series.values[start:stop]
+
+    def metrics(self, land_cover, start_year, end_year):
+        # Same as sum(), max() - min() and diff().mean() of the filtered rows
+        series = self.series.get(land_cover, self.empty)
+        return series.metrics(*series.bounds(start_year, end_year))
@@ -0,0 +1,255 @@
+import argparse
+import json
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from cube_store import LandCoverCube, cube_paths, open_cubes
+from ingest import land_cover_mapping
+from transitions import N_CLASSES, to_class_index
+
+# Pixels per side of an index block. Each (tile, year) stores a summed-area table of
+# per-block class histograms, so any rectangle costs four lookups for its aligned
+# interior plus a scan of the thin (< INDEX_BLOCK px) strips along its edges.
+INDEX_BLOCK = 16
+
+# MODIS sinusoidal grid constants
+EARTH_RADIUS = 6371007.181
+TILE_SIZE = 1111950.5197665233
+GRID_X_MIN = -20015109.355798
+GRID_Y_MAX = 10007554.677899
+
+REGIONS_FILE = "regions.json"
+
+
+def index_paths(index_dir, tile):
+    return os.path.join(index_dir, f"{tile}.npy"), os.path.join(index_dir, f"{tile}.json")
+
+
+def block_histograms(year_view, block=INDEX_BLOCK, band_blocks=16):
+    # (n_block_rows, n_block_cols, N_CLASSES) class counts of one year, one band of rows at a time
+    n_rows, n_cols = year_view.shape
+    n_block_rows, n_block_cols = -(-n_rows // block), -(-n_cols // block)
+    histograms = np.zeros((n_block_rows, n_block_cols, N_CLASSES), dtype=np.int64)
+    col_blocks = (np.arange(n_cols, dtype=np.int32) // block) * N_CLASSES
+    band_rows = band_blocks * block
+    for start in range(0, n_rows, band_rows):
+        band = year_view[start:start + band_rows]
+        row_blocks = (np.arange(band.shape[0], dtype=np.int32) // block) * (n_block_cols * N_CLASSES)
+        index = row_blocks[:, None] + col_blocks[None, :] + to_class_index(band)
+        first = start // block
+        n_band_blocks = -(-band.shape[0] // block)
+        counts = np.bincount(index.ravel(), minlength=n_band_blocks * n_block_cols * N_CLASSES)
+        histograms[first:first + n_band_blocks] = counts.reshape(n_band_blocks, n_block_cols, N_CLASSES)
+    return histograms
+
+
+def summed_area_table(histograms):
+    # Cumulative sums over both block axes with a leading row and column of zeros
+    n_block_rows, n_block_cols, n_classes = histograms.shape
+    table = np.zeros((n_block_rows + 1, n_block_cols + 1, n_classes), dtype=np.int32)
+    table[1:, 1:] = histograms.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def _build_tile(cube_dir, index_dir, tile, block):
+    # Worker entry point: summed-area tables of every year of one tile. Years built from
+    # the same granule as in the previous index are copied instead of recomputed.
+    cube = LandCoverCube(cube_dir, tile, "LC_Type1")
+    sources = cube.meta.get("sources", {})
+    data_path, meta_path = index_paths(index_dir, tile)
+    previous, previous_tables = {}, None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            previous = json.load(f)
+        if previous.get("block") == block and previous.get("shape") == [cube.n_rows, cube.n_cols]:
+            previous_tables = np.load(data_path, mmap_mode="r")
+
+    n_block_rows, n_block_cols = -(-cube.n_rows // block), -(-cube.n_cols // block)
+    tables = np.lib.format.open_memmap(
+        data_path + ".tmp", mode="w+", dtype=np.int32,
+        shape=(len(cube.years), n_block_rows + 1, n_block_cols + 1, N_CLASSES),
+    )
+    reused = 0
+    for year_index, year in enumerate(cube.years):
+        source = sources.get(str(year))
+        if previous_tables is not None and source and previous.get("sources", {}).get(str(year)) == source:
+            tables[year_index] = previous_tables[previous["years"].index(year)]
+            reused += 1
+        else:
+            tables[year_index] = summed_area_table(block_histograms(cube.year(year), block))
+    tables.flush()
+    del tables, previous_tables
+    meta = {"tile": tile, "years": cube.years, "block": block, "shape": [cube.n_rows, cube.n_cols], "sources": sources}
+    os.replace(data_path + ".tmp", data_path)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+    return tile, reused
+
+
+def build_index(cube_dir, index_dir, block=INDEX_BLOCK, workers=None):
+    os.makedirs(index_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_build_tile, cube_dir, index_dir, tile, block)
+            for tile in open_cubes(cube_dir, "LC_Type1")
+        ]
+        for future in as_completed(futures):
+            tile, reused = future.result()
+            print(f"Indexed tile: {tile} ({reused} years unchanged)")
+
+
+def lat_lon_to_pixel(tile, lat, lon, n_rows, n_cols):
+    # Fractional (row, col) of a point inside a MODIS sinusoidal tile such as 'h18v05'
+    h, v = int(tile[1:3]), int(tile[4:6])
+    x = EARTH_RADIUS * math.radians(lon) * math.cos(math.radians(lat))
+    y = EARTH_RADIUS * math.radians(lat)
+    row = ((GRID_Y_MAX - v * TILE_SIZE) - y) / (TILE_SIZE / n_rows)
+    col = (x - (GRID_X_MIN + h * TILE_SIZE)) / (TILE_SIZE / n_cols)
+    return row, col
+
+
+def bbox_to_pixels(tile, lat_min, lat_max, lon_min, lon_max, n_rows, n_cols):
+    # Pixel rectangle of a tile covering a lat/lon box, or None if they do not overlap.
+    # The box is curved in sinusoidal space, so its widest latitude (closest to the
+    # equator) is included along with the corners.
+    widest_lat = min(max(0.0, lat_min), lat_max)
+    points = [
+        lat_lon_to_pixel(tile, lat, lon, n_rows, n_cols)
+        for lat in (lat_min, lat_max, widest_lat)
+        for lon in (lon_min, lon_max)
+    ]
+    rows = [row for row, _ in points]
+    cols = [col for _, col in points]
+    row_start, row_stop = max(0, math.floor(min(rows))), min(n_rows, math.ceil(max(rows)))
+    col_start, col_stop = max(0, math.floor(min(cols))), min(n_cols, math.ceil(max(cols)))
+    if row_start >= row_stop or col_start >= col_stop:
+        return None
+    return row_start, row_stop, col_start, col_stop
+
+
+def load_regions(path=REGIONS_FILE):
+    # Named regions as {name: [lat_min, lat_max, lon_min, lon_max]}
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class RegionIndex:
+    # Per-class pixel counts of any rectangle of the land cover rasters
+
+    def __init__(self, index_dir="region_index", cube_dir="land_cover_cubes"):
+        self.index_dir = index_dir
+        self.cube_dir = cube_dir
+        self.signature = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _signature(self):
+        # Modification times of the index and cube sidecars, which are replaced last on every rebuild
+        stamps = []
+        for file_name in sorted(os.listdir(self.index_dir)):
+            if file_name.endswith(".json"):
+                tile = file_name[:-len(".json")]
+                for path in (index_paths(self.index_dir, tile)[1], cube_paths(self.cube_dir, tile, "LC_Type1")[1]):
+                    stamps.append((path, os.stat(path).st_mtime_ns))
+        return tuple(stamps)
+
+    def refresh(self):
+        # Reopen the index and cubes when region_index.py or cube_store.py has rebuilt them.
+        # While a rebuild is half done (a sidecar is missing), the loaded index stays in use.
+        try:
+            signature = self._signature()
+        except OSError:
+            if self.signature is None:
+                raise
+            return self
+        if signature != self.signature:
+            with self._lock:
+                if signature != self.signature:
+                    tables, meta, cubes = {}, {}, {}
+                    for path, _ in signature[::2]:
+                        tile = os.path.basename(path)[:-len(".json")]
+                        data_path, meta_path = index_paths(self.index_dir, tile)
+                        with open(meta_path) as f:
+                            meta[tile] = json.load(f)
+                        tables[tile] = np.load(data_path, mmap_mode="r")
+                        cubes[tile] = LandCoverCube(self.cube_dir, tile, "LC_Type1")
+                    self.tables, self.meta, self.cubes = tables, meta, cubes
+                    self.years = sorted({year for tile_meta in meta.values() for year in tile_meta["years"]})
+                    self.signature = signature
+        return self
+
+    def _scan(self, tile, year, row_start, row_stop, col_start, col_stop):
+        if row_start >= row_stop or col_start >= col_stop:
+            return np.zeros(N_CLASSES, dtype=np.int64)
+        window = self.cubes[tile].year(year)[row_start:row_stop, col_start:col_stop]
+        return np.bincount(to_class_index(window).ravel(), minlength=N_CLASSES)
+
+    def query_pixels(self, tile, year, row_start, row_stop, col_start, col_stop):
+        # Class counts of rows [row_start, row_stop) x cols [col_start, col_stop) of a tile
+        meta = self.meta[tile]
+        if year not in meta["years"]:
+            return np.zeros(N_CLASSES, dtype=np.int64)
+        block = meta["block"]
+        block_row_start, block_row_stop = -(-row_start // block), row_stop // block
+        block_col_start, block_col_stop = -(-col_start // block), col_stop // block
+        if block_row_start >= block_row_stop or block_col_start >= block_col_stop:
+            return self._scan(tile, year, row_start, row_stop, col_start, col_stop)
+
+        table = self.tables[tile][meta["years"].index(year)]
+        counts = (
+            table[block_row_stop, block_col_stop] - table[block_row_start, block_col_stop]
+            - table[block_row_stop, block_col_start] + table[block_row_start, block_col_start]
+        ).astype(np.int64)
+
+        # Edge strips outside the block-aligned interior
+        inner_row_start, inner_row_stop = block_row_start * block, block_row_stop * block
+        inner_col_start, inner_col_stop = block_col_start * block, block_col_stop * block
+        counts += self._scan(tile, year, row_start, inner_row_start, col_start, col_stop)
+        counts += self._scan(tile, year, inner_row_stop, row_stop, col_start, col_stop)
+        counts += self._scan(tile, year, inner_row_start, inner_row_stop, col_start, inner_col_start)
+        counts += self._scan(tile, year, inner_row_start, inner_row_stop, inner_col_stop, col_stop)
+        return counts
+
+    def query_bbox(self, year, lat_min, lat_max, lon_min, lon_max):
+        # Class counts of a lat/lon box, summed over every indexed tile it touches
+        counts = np.zeros(N_CLASSES, dtype=np.int64)
+        for tile, meta in self.meta.items():
+            n_rows, n_cols = meta["shape"]
+            pixels = bbox_to_pixels(tile, lat_min, lat_max, lon_min, lon_max, n_rows, n_cols)
+            if pixels is not None:
+                counts += self.query_pixels(tile, year, *pixels)
+        return counts
+
+    def class_areas(self, year, lat_min, lat_max, lon_min, lon_max):
+        # {Land_Cover_Type: area in sq. km} for a lat/lon box. Each tile's counts are scaled
+        # by its own pixel area, since tiles may differ in resolution.
+        class_areas = np.zeros(N_CLASSES)
+        for tile, meta in self.meta.items():
+            n_rows, n_cols = meta["shape"]
+            pixels = bbox_to_pixels(tile, lat_min, lat_max, lon_min, lon_max, n_rows, n_cols)
+            if pixels is not None:
+                pixel_area = (TILE_SIZE / n_rows) * (TILE_SIZE / n_cols) / 1e6
+                class_areas += self.query_pixels(tile, year, *pixels) * pixel_area
+        return {land_cover_mapping[int(class_index)]: float(class_areas[class_index]) for class_index in np.flatnonzero(class_areas)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the block-histogram region index from a cube store.")
+    parser.add_argument("--cube-dir", default="land_cover_cubes")
+    parser.add_argument("--index-dir", default="region_index")
+    parser.add_argument("--block", type=int, default=INDEX_BLOCK, help="Pixels per side of an index block")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    build_index(args.cube_dir, args.index_dir, args.block, args.workers)
+
+
+if __name__ == "__main__":
+    main()
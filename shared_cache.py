@@ -0,0 +1,121 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from functools import lru_cache, wraps
+
+# Result cache shared by every process on the host through one SQLite file (WAL mode,
+# so readers never block each other). Entries are tagged with the dataset version they
+# were computed from, evicted least-recently-used beyond max_bytes, and dropped when a
+# new version of the dataset appears.
+CACHE_PATH = os.environ.get("DASHBOARD_CACHE_PATH", ".dashboard_cache.sqlite")
+MAX_BYTES = 256 * 1024 * 1024
+
+# Refresh an entry's access time at most this often (seconds), to keep hits read-only
+TOUCH_INTERVAL = 30
+
+
+class SharedCache:
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, version TEXT, value BLOB, size INTEGER, accessed REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _connect(self):
+        # One connection per thread and process (connections must not cross a fork)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, version):
+        # (True, value) on a hit, (False, None) otherwise
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT value, accessed FROM entries WHERE key = ? AND version = ?", (key, version)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL:
+            connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return True, pickle.loads(row[0])
+
+    def set(self, key, version, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (key, version, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, version, blob, len(blob), time.time()),
+        )
+        self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        connection = self._connect()
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+                if total <= self.max_bytes * 0.9:
+                    break
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def drop_other_versions(self, version):
+        # Entries computed from an older (or newer) dataset snapshot
+        self._connect().execute("DELETE FROM entries WHERE version != ?", (version,))
+
+    def stats(self):
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+
+def memoize(cache, version_func, maxsize=512):
+    # Memoize a function of hashable arguments in a per-process LRU backed by the shared
+    # cache. Results are keyed by the current dataset version, so a new snapshot
+    # invalidates both levels.
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @lru_cache(maxsize=maxsize)
+        def local(version, *args):
+            key = hashlib.sha1(repr((name, args)).encode()).hexdigest()
+            found, value = cache.get(key, version)
+            if not found:
+                value = func(*args)
+                cache.set(key, version, value)
+            return value
+
+        @wraps(func)
+        def wrapper(*args):
+            return local(version_func(), *args)
+
+        wrapper.cache_info = local.cache_info
+        wrapper.cache_clear = local.cache_clear
+        return wrapper
+
+    return decorator
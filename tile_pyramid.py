@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
+import numpy as np
+from flask import Response, abort, request
+
+from cube_store import LandCoverCube, open_cubes
+from ingest import land_cover_mapping
+from region_index import EARTH_RADIUS, GRID_X_MIN, GRID_Y_MAX, TILE_SIZE, block_histograms
+from transitions import FILL_CLASS, N_CLASSES, to_class_index
+
+# Level k of the pyramid aggregates 2**k x 2**k MODIS pixels
+PYRAMID_LEVELS = 6
+TILE_PIXELS = 256
+MANIFEST_FILE = "manifest.json"
+SOURCE_FILE = "source.json"
+
+# IGBP legend colours (RGB); Unclassified gets magenta so it is never read as Water,
+# and the fill class is drawn transparent
+CLASS_COLORS = np.array([
+    (28, 13, 255), (5, 69, 10), (8, 106, 16), (84, 167, 8), (120, 210, 3),
+    (0, 153, 0), (198, 176, 68), (220, 209, 89), (218, 222, 72), (251, 255, 19),
+    (182, 255, 5), (39, 255, 135), (194, 79, 68), (165, 165, 165), (255, 109, 76),
+    (105, 255, 248), (249, 255, 164), (255, 0, 255), (0, 0, 0),
+], dtype=np.uint8)
+
+CLASS_INDEX = {name: index for index, name in land_cover_mapping.items()}
+
+
+def level_dir(pyramid_dir, tile, year):
+    return os.path.join(pyramid_dir, tile, str(year))
+
+
+def _build_tile_year(cube_dir, pyramid_dir, tile, year, levels):
+    # Worker entry point: majority and per-class fraction rasters of one tile-year.
+    # Tile-years already built from the same granule are left as they are.
+    cube = LandCoverCube(cube_dir, tile, "LC_Type1")
+    out_dir = level_dir(pyramid_dir, tile, year)
+    stamp = {"source": cube.meta.get("sources", {}).get(str(year)), "levels": levels}
+    stamp_path = os.path.join(out_dir, SOURCE_FILE)
+    if stamp["source"] and os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if json.load(f) == stamp:
+                return tile, year, False
+
+    year_view = to_class_index(cube.year(year))
+    os.makedirs(out_dir, exist_ok=True)
+    # Drop the stamp and any class fractions left over from a previous build
+    for file_name in os.listdir(out_dir):
+        os.remove(os.path.join(out_dir, file_name))
+    np.save(os.path.join(out_dir, "majority_0.npy"), year_view)
+    for level in range(1, levels):
+        histograms = block_histograms(year_view, 2 ** level)
+        totals = histograms.sum(axis=2)
+        # Blocks made only of fill keep the fill class as their majority
+        valid = histograms[:, :, :FILL_CLASS]
+        majority = np.where(valid.sum(axis=2) > 0, valid.argmax(axis=2), FILL_CLASS).astype(np.uint8)
+        np.save(os.path.join(out_dir, f"majority_{level}.npy"), majority)
+        for class_index in np.flatnonzero(valid.sum(axis=(0, 1))):
+            fraction = (histograms[:, :, class_index] * 255 // np.maximum(totals, 1)).astype(np.uint8)
+            np.save(os.path.join(out_dir, f"fraction_{level}_{class_index}.npy"), fraction)
+    with open(stamp_path, "w") as f:
+        json.dump(stamp, f)
+    return tile, year, True
+
+
+def build_pyramid(cube_dir, pyramid_dir, levels=PYRAMID_LEVELS, workers=None):
+    cubes = open_cubes(cube_dir, "LC_Type1")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_build_tile_year, cube_dir, pyramid_dir, tile, year, levels)
+            for tile, cube in cubes.items()
+            for year in cube.years
+        ]
+        for future in as_completed(futures):
+            tile, year, built = future.result()
+            if built:
+                print(f"Built pyramid: {tile}, {year}")
+
+    manifest = {
+        "levels": levels,
+        "tiles": {tile: {"years": cube.years, "shape": [cube.n_rows, cube.n_cols]} for tile, cube in cubes.items()},
+    }
+    # The version changes on every build and is part of every ETag
+    manifest["version"] = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode() + os.urandom(8)).hexdigest()[:12]
+    with open(os.path.join(pyramid_dir, MANIFEST_FILE + ".tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(pyramid_dir, MANIFEST_FILE + ".tmp"), os.path.join(pyramid_dir, MANIFEST_FILE))
+
+
+def encode_png(rgba):
+    # Minimal RGBA PNG encoder (no imaging dependency)
+    height, width, _ = rgba.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b"")
+    )
+
+
+class TilePyramid:
+    # Renders web-mercator XYZ PNG tiles from the sinusoidal pyramid
+
+    def __init__(self, pyramid_dir="tile_pyramid", cache_size=2048):
+        self.pyramid_dir = pyramid_dir
+        self.cache_size = cache_size
+        self.manifest_mtime = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        # Reload the manifest (and drop the cached tiles) when build_pyramid has rewritten it
+        path = os.path.join(self.pyramid_dir, MANIFEST_FILE)
+        mtime = os.stat(path).st_mtime_ns
+        if mtime != self.manifest_mtime:
+            with self._lock:
+                if mtime != self.manifest_mtime:
+                    with open(path) as f:
+                        manifest = json.load(f)
+                    # In-process LRU of encoded PNG tiles and of opened (memory-mapped) levels
+                    self.render = lru_cache(maxsize=self.cache_size)(self._render)
+                    self._load = lru_cache(maxsize=256)(self._open_level)
+                    self.manifest = manifest
+                    self.years = sorted({year for tile in manifest["tiles"].values() for year in tile["years"]})
+                    self.version = manifest["version"]
+                    self.manifest_mtime = mtime
+        return self.version
+
+    def _open_level(self, tile, year, name):
+        path = os.path.join(level_dir(self.pyramid_dir, tile, year), f"{name}.npy")
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode="r")
+
+    def _render(self, year, layer, z, x, y):
+        # layer is 'majority' or a class index for its fraction
+        n = 2 ** z
+        pixel = (np.arange(TILE_PIXELS) + 0.5) / TILE_PIXELS
+        lon = (x + pixel[None, :]) / n * 360.0 - 180.0
+        lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixel[:, None]) / n))))
+        lon, lat = np.broadcast_arrays(lon, lat)
+
+        # Pick the level whose pixel size best matches the output resolution
+        center_lat = math.radians(float(lat[TILE_PIXELS // 2, 0]))
+        meters_per_pixel = 2 * math.pi * 6378137.0 * math.cos(center_lat) / (n * TILE_PIXELS)
+
+        sin_x = EARTH_RADIUS * np.radians(lon) * np.cos(np.radians(lat))
+        sin_y = EARTH_RADIUS * np.radians(lat)
+        grid_h = np.floor((sin_x - GRID_X_MIN) / TILE_SIZE).astype(int)
+        grid_v = np.floor((GRID_Y_MAX - sin_y) / TILE_SIZE).astype(int)
+
+        rgba = np.zeros((TILE_PIXELS, TILE_PIXELS, 4), dtype=np.uint8)
+        for tile, info in self.manifest["tiles"].items():
+            if year not in info["years"]:
+                continue
+            h, v = int(tile[1:3]), int(tile[4:6])
+            inside = (grid_h == h) & (grid_v == v)
+            if not inside.any():
+                continue
+            n_rows, n_cols = info["shape"]
+            base_pixel = TILE_SIZE / n_cols
+            level = min(max(int(math.log2(max(meters_per_pixel / base_pixel, 1.0))), 0), self.manifest["levels"] - 1)
+
+            majority = self._load(tile, year, f"majority_{level}")
+            scale = base_pixel * 2 ** level
+            rows = ((GRID_Y_MAX - v * TILE_SIZE - sin_y[inside]) / scale).astype(int).clip(0, majority.shape[0] - 1)
+            cols = ((sin_x[inside] - GRID_X_MIN - h * TILE_SIZE) / scale).astype(int).clip(0, majority.shape[1] - 1)
+            classes = majority[rows, cols]
+
+            if layer == "majority":
+                rgba[inside, :3] = CLASS_COLORS[classes]
+                rgba[inside, 3] = np.where(classes == FILL_CLASS, 0, 255)
+            else:
+                class_index = int(layer)
+                if level == 0:
+                    alpha = np.where(classes == class_index, 255, 0)
+                else:
+                    fraction = self._load(tile, year, f"fraction_{level}_{class_index}")
+                    alpha = fraction[rows, cols] if fraction is not None else 0
+                rgba[inside, :3] = CLASS_COLORS[class_index]
+                rgba[inside, 3] = alpha
+        return encode_png(rgba)
+
+    def tile_url(self, year, land_cover=None, base_url=""):
+        # URL template for a Plotly/MapLibre raster layer: a class fraction layer for
+        # known classes, otherwise the majority-class layer. The pyramid version is part of
+        # the URL, so a rebuilt pyramid is never served from a browser cache.
+        layer = CLASS_INDEX.get(land_cover, "majority")
+        return f"{base_url.rstrip('/')}/tiles/{self.version}/{year}/{layer}/{{z}}/{{x}}/{{y}}.png"
+
+
+def register_tile_routes(server, pyramid):
+    # Serve tiles from the Dash Flask server with HTTP caching
+    @server.route("/tiles/<version>/<int:year>/<layer>/<int:z>/<int:x>/<int:y>.png")
+    def serve_tile(version, year, layer, z, x, y):
+        if layer != "majority" and not (layer.isdigit() and int(layer) < N_CLASSES):
+            abort(404)
+        if z > 18 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            abort(404)
+
+        # Tiles of the current version never change; a URL of an older version gets the
+        # current tile, revalidated on every use
+        current = pyramid.refresh()
+        etag = f'"{current}-{year}-{layer}-{z}-{x}-{y}"'
+        cache_control = "public, max-age=31536000, immutable" if version == current else "no-cache"
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=304, headers=headers)
+        return Response(pyramid.render(year, layer, z, x, y), mimetype="image/png", headers=headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the multi-resolution land cover tile pyramid.")
+    parser.add_argument("--cube-dir", default="land_cover_cubes")
+    parser.add_argument("--pyramid-dir", default="tile_pyramid")
+    parser.add_argument("--levels", type=int, default=PYRAMID_LEVELS)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    build_pyramid(args.cube_dir, args.pyramid_dir, args.levels, args.workers)
+
+
+if __name__ == "__main__":
+    main()
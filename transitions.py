@@ -0,0 +1,205 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from pyhdf.SD import SD, SDC
+
+from cube_store import LandCoverCube, open_cubes
+from ingest import BLOCK_ROWS, find_granules, land_cover_mapping
+
+# Classes 0-17 of the mapping plus 18 ('Fill Value'), which also absorbs the 255 fill code
+N_CLASSES = 19
+FILL_CLASS = 18
+
+
+def to_class_index(block):
+    # Fold every code above the last real class into the fill class
+    return np.minimum(block, FILL_CLASS)
+
+
+def transition_counts(from_block, to_block):
+    # One bincount over from*19+to gives the full 19x19 transition matrix of a block
+    pair_index = to_class_index(from_block).astype(np.int16) * N_CLASSES + to_class_index(to_block)
+    return np.bincount(pair_index.ravel(), minlength=N_CLASSES * N_CLASSES)
+
+
+def parse_pairs(pair_args, years):
+    # '2001:2023' style arguments; default to every consecutive pair of years
+    if not pair_args:
+        return list(zip(years[:-1], years[1:]))
+    pairs = []
+    for pair_arg in pair_args:
+        from_year, to_year = (int(year) for year in pair_arg.split(":"))
+        pairs.append((from_year, to_year))
+    return pairs
+
+
+def _count_rows(data_dir, file_names, pairs, layer, row_start, row_stop, block_rows):
+    # Worker entry point: transitions of every pair over a range of rows of one tile.
+    # Only the current block of each year's raster is held in memory.
+    hdf_files = {}
+    datasets = {}
+    try:
+        for year, file_name in file_names.items():
+            hdf_files[year] = SD(os.path.join(data_dir, file_name), SDC.READ)
+            datasets[year] = hdf_files[year].select(layer)
+        counts = {pair: np.zeros(N_CLASSES * N_CLASSES, dtype=np.int64) for pair in pairs}
+        for start in range(row_start, row_stop, block_rows):
+            stop = min(start + block_rows, row_stop)
+            blocks = {year: sds[start:stop] for year, sds in datasets.items()}
+            for from_year, to_year in pairs:
+                counts[(from_year, to_year)] += transition_counts(blocks[from_year], blocks[to_year])
+        return counts
+    finally:
+        # Released even when a file or a read fails part way
+        for sds in datasets.values():
+            sds.endaccess()
+        for hdf_file in hdf_files.values():
+            hdf_file.end()
+
+
+def _count_cube_rows(cube_dir, tile, pairs, layer, row_start, row_stop, block_rows):
+    # Worker entry point: same as _count_rows, reading zero-copy blocks of a cube
+    cube = LandCoverCube(cube_dir, tile, layer)
+    counts = {pair: np.zeros(N_CLASSES * N_CLASSES, dtype=np.int64) for pair in pairs}
+    for start in range(row_start, row_stop, block_rows):
+        block = cube.data[start:min(start + block_rows, row_stop)]
+        for from_year, to_year in pairs:
+            counts[(from_year, to_year)] += transition_counts(
+                block[:, :, cube.year_index(from_year)], block[:, :, cube.year_index(to_year)]
+            )
+    return counts
+
+
+def rows_per_chunk(n_rows, block_rows):
+    # A few row ranges per tile so even a single tile uses every core
+    n_blocks = -(-n_rows // block_rows)
+    return max(1, n_blocks // (os.cpu_count() or 1)) * block_rows
+
+
+def compute_cube_transitions(cube_dir, pairs=None, layer="LC_Type1", block_rows=BLOCK_ROWS, workers=None):
+    # Same as compute_transitions, read from a cube store built by cube_store.py
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for tile, cube in open_cubes(cube_dir, layer).items():
+            tile_pairs = [
+                pair for pair in parse_pairs(pairs, cube.years)
+                if pair[0] in cube.years and pair[1] in cube.years
+            ]
+            if not tile_pairs:
+                continue
+            chunk = rows_per_chunk(cube.n_rows, block_rows)
+            for row_start in range(0, cube.n_rows, chunk):
+                future = executor.submit(
+                    _count_cube_rows, cube_dir, tile, tile_pairs, layer,
+                    row_start, min(row_start + chunk, cube.n_rows), block_rows,
+                )
+                futures[future] = tile
+        merge_results(results, futures)
+    return results
+
+
+def merge_results(results, futures):
+    # Sum the per-chunk matrices of each (tile, from_year, to_year)
+    for future in as_completed(futures):
+        tile = futures[future]
+        for (from_year, to_year), counts in future.result().items():
+            key = (tile, from_year, to_year)
+            if key in results:
+                results[key] += counts
+            else:
+                results[key] = counts
+
+
+def compute_transitions(data_dir, pairs=None, layer="LC_Type1", block_rows=BLOCK_ROWS, workers=None):
+    # Fan (tile, row range) chunks out across a process pool; result keyed by (tile, from_year, to_year)
+    granules = find_granules(data_dir)
+    tiles = sorted({tile for tile, _ in granules})
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for tile in tiles:
+            tile_years = sorted(year for granule_tile, year in granules if granule_tile == tile)
+            tile_pairs = [
+                pair for pair in parse_pairs(pairs, tile_years)
+                if pair[0] in tile_years and pair[1] in tile_years
+            ]
+            if not tile_pairs:
+                continue
+            needed_years = sorted({year for pair in tile_pairs for year in pair})
+            file_names = {year: granules[(tile, year)] for year in needed_years}
+
+            first_file = SD(os.path.join(data_dir, file_names[needed_years[0]]), SDC.READ)
+            try:
+                sds = first_file.select(layer)
+                try:
+                    n_rows = sds.info()[2][0]
+                finally:
+                    sds.endaccess()
+            finally:
+                first_file.end()
+
+            chunk = rows_per_chunk(n_rows, block_rows)
+            for row_start in range(0, n_rows, chunk):
+                row_stop = min(row_start + chunk, n_rows)
+                future = executor.submit(
+                    _count_rows, data_dir, file_names, tile_pairs, layer, row_start, row_stop, block_rows
+                )
+                futures[future] = tile
+        merge_results(results, futures)
+
+    return results
+
+
+def transitions_to_frame(results):
+    # Compact long table: one row per non-zero (tile, year pair, from class, to class)
+    rows = []
+    for (tile, from_year, to_year), counts in sorted(results.items()):
+        for index in np.flatnonzero(counts):
+            from_class, to_class = divmod(int(index), N_CLASSES)
+            rows.append((
+                tile, from_year, to_year,
+                land_cover_mapping[from_class], land_cover_mapping[to_class],
+                int(counts[index]),
+            ))
+    return pd.DataFrame(rows, columns=["Tile", "From_Year", "To_Year", "From_Type", "To_Type", "Pixels"])
+
+
+def load_transitions(path="land_cover_transitions.csv", from_year=None, to_year=None):
+    # Region-level transitions (summed over tiles), optionally for a single pair of years
+    df = pd.read_csv(path)
+    if from_year is not None:
+        df = df[df["From_Year"] == from_year]
+    if to_year is not None:
+        df = df[df["To_Year"] == to_year]
+    return df.groupby(["From_Year", "To_Year", "From_Type", "To_Type"], as_index=False)["Pixels"].sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute land cover transition (from -> to) matrices.")
+    parser.add_argument("data_dir", nargs="?", help="Directory containing the MCD12Q1 .hdf files")
+    parser.add_argument("--cube-dir", help="Read from a cube store built by cube_store.py instead of the HDF files")
+    parser.add_argument("--pairs", nargs="*", help="Year pairs as FROM:TO (default: consecutive years)")
+    parser.add_argument("--layer", default="LC_Type1")
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--output", default="land_cover_transitions.csv")
+    args = parser.parse_args()
+    if not args.data_dir and not args.cube_dir:
+        parser.error("either data_dir or --cube-dir is required")
+
+    if args.cube_dir:
+        results = compute_cube_transitions(args.cube_dir, args.pairs, args.layer, args.block_rows, args.workers)
+    else:
+        results = compute_transitions(args.data_dir, args.pairs, args.layer, args.block_rows, args.workers)
+    transitions_df = transitions_to_frame(results)
+    transitions_df.to_csv(args.output, index=False)
+    print(f"Transitions saved as '{args.output}' ({len(transitions_df)} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import data_access
+from forecasting import build_series, series_hash
+
+# Define the hyperparameter grid
+PARAM_GRID = {
+    'changepoint_prior_scale': [0.001, 0.01, 0.1, 0.5],
+    'seasonality_prior_scale': [0.1, 1.0, 10.0]
+}
+
+# Per-fold errors, keyed by a content hash of the fold and parameters
+CACHE_DIR = "tuning_cache"
+
+
+def all_params(param_grid=PARAM_GRID):
+    # Generate all combinations of parameters
+    return [dict(zip(param_grid.keys(), v)) for v in itertools.product(*param_grid.values())]
+
+
+def make_cutoffs(n_points, initial, horizon):
+    # Rolling-origin cutoffs (number of training points), computed once per series
+    return list(range(initial, n_points - horizon + 1))
+
+
+def fold_error(y_true, y_pred, metric):
+    if metric == "mape":
+        # Over the non-zero actuals only, as in calculate.score; NaN if every actual is 0
+        nonzero = y_true != 0
+        if not nonzero.any():
+            return float("nan")
+        return float(np.mean(np.abs((y_true[nonzero] - y_pred[nonzero]) / y_true[nonzero])))
+    return float(np.sqrt(np.mean((y_true - y_pred) ** 2)))
+
+
+def mean_error(fold_errors):
+    # Mean over the folds that have an error (NaN when none has)
+    values = [error for error in fold_errors if not np.isnan(error)]
+    return float(np.mean(values)) if values else np.nan
+
+
+def _evaluate(series_df, params, cutoffs, horizon, metric, cache_dir):
+    # Worker entry point: errors of one parameter combination on some folds of one series
+    from prophet import Prophet
+
+    logging.getLogger("cmdstanpy").setLevel(logging.WARNING)
+    errors = []
+    for cutoff in cutoffs:
+        fold_df = series_df.iloc[:cutoff + horizon]
+        # MAPE entries cached before zero actuals were masked have a different key
+        cache_metric = "mape_nonzero" if metric == "mape" else metric
+        key = series_hash(fold_df, {**params, "metric": cache_metric}, horizon, backend="prophet")
+        cache_path = os.path.join(cache_dir, key + ".json")
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                errors.append(json.load(f)["error"])
+            continue
+
+        train_df, test_df = fold_df.iloc[:cutoff], fold_df.iloc[cutoff:]
+        model = Prophet(**params)
+        model.fit(train_df)
+        forecast = model.predict(test_df[["ds"]])
+        error = fold_error(test_df["y"].values, forecast["yhat"].values, metric)
+
+        # Written under a per-process temporary name, so a worker evaluating the same fold
+        # never reads (or writes into) a partial file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"error": error}, f)
+        os.replace(tmp_path, cache_path)
+        errors.append(error)
+    return errors
+
+
+def tune(series, param_grid=PARAM_GRID, initial=10, horizon=1, metric="rmse",
+         prune_after=3, prune_margin=0.5, workers=None, cache_dir=CACHE_DIR):
+    # Two rounds over a process pool: every candidate on the first folds, then only the
+    # candidates within prune_margin of the best one on the remaining folds
+    os.makedirs(cache_dir, exist_ok=True)
+    candidates = all_params(param_grid)
+    cutoffs = {name: make_cutoffs(len(df), initial, horizon) for name, df in series.items()}
+    errors = {(name, index): [] for name in series for index in range(len(candidates))}
+    pruned = set()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def run_round(keys, fold_slice):
+            futures = {}
+            for name, index in keys:
+                folds = cutoffs[name][fold_slice]
+                if folds:
+                    future = executor.submit(
+                        _evaluate, series[name], candidates[index], folds, horizon, metric, cache_dir
+                    )
+                    futures[future] = (name, index)
+            for future in as_completed(futures):
+                errors[futures[future]].extend(future.result())
+
+        # Round 1: all candidates on the first folds
+        run_round(list(errors), slice(0, prune_after))
+
+        # Prune candidates that are clearly worse than the best of their series
+        for name in series:
+            means = {index: mean_error(errors[(name, index)]) for index in range(len(candidates))}
+            means = {index: mean for index, mean in means.items() if not np.isnan(mean)}
+            if not means:
+                continue
+            best = min(means.values())
+            for index, mean in means.items():
+                if mean > best * (1 + prune_margin):
+                    pruned.add((name, index))
+            survivors = len(candidates) - sum(1 for key in pruned if key[0] == name)
+            print(f"{name}: {survivors}/{len(candidates)} candidates kept after {prune_after} folds")
+
+        # Round 2: survivors on the remaining folds
+        run_round([key for key in errors if key not in pruned], slice(prune_after, None))
+
+    rows = []
+    for (name, index), fold_errors in errors.items():
+        rows.append({
+            "Land_Cover_Type": name,
+            **candidates[index],
+            "Folds": len(fold_errors),
+            "Error": mean_error(fold_errors),
+            "Pruned": (name, index) in pruned,
+        })
+    results_df = pd.DataFrame(rows)
+
+    # Best parameters per class among the candidates evaluated on every fold
+    best_params = {}
+    for name, group in results_df[~results_df["Pruned"]].dropna(subset=["Error"]).groupby("Land_Cover_Type"):
+        best = group.loc[group["Error"].idxmin()]
+        best_params[name] = {key: float(best[key]) for key in param_grid}
+    return best_params, results_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel Prophet hyperparameter search with early pruning.")
+    parser.add_argument("--initial", type=int, default=10, help="Training years before the first cutoff")
+    parser.add_argument("--horizon", type=int, default=1, help="Years forecast after each cutoff")
+    parser.add_argument("--metric", choices=["rmse", "mape"], default="rmse")
+    parser.add_argument("--prune-after", type=int, default=3, help="Folds evaluated before pruning")
+    parser.add_argument("--prune-margin", type=float, default=0.5,
+                        help="Drop candidates whose error exceeds the best by this fraction")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--output", default="best_params.json")
+    parser.add_argument("--results-output", default="tuning_results.csv")
+    args = parser.parse_args()
+
+    series = build_series(data_access.load_history())
+    best_params, results_df = tune(
+        series, PARAM_GRID, args.initial, args.horizon, args.metric,
+        args.prune_after, args.prune_margin, args.workers, args.cache_dir,
+    )
+    results_df.to_csv(args.results_output, index=False)
+    with open(args.output, "w") as f:
+        json.dump(best_params, f, indent=2)
+    print(f"Best parameters saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()